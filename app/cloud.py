@@ -1,100 +1,245 @@
-import cloudinary
-import cloudinary.uploader
 from core.settings import settings
-from PIL import Image
+from core import metrics
+from core.executors import SharedBytes, image_executor, io_executor, read_shared
+from app import crud, database, similar, tasks
+from app.storage import get_storage
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from PIL import Image, UnidentifiedImageError, features
 import io
 import asyncio
 import hashlib
-import re
+import math
 
 THUMBNAIL="thumbnail" #"templates/thumbnails"
 THUMBNAIL_SIZE=512
+IMAGE_SIZE=2048
+RENDITIONS="renditions"
 
-cloudinary.config(
-    cloud_name=settings.cloud_name,
-    api_key=settings.cloud_api_key,
-    api_secret=settings.cloud_api_secret,
-    secure=True
-)
+# responsive ladder for templates (Template.renditions), longest side in px
+RENDITION_SIZES = tuple(sorted({int(s) for s in settings.rendition_sizes.split(",") if s.strip()}))
+RENDITION_FORMATS = ("webp", "avif") if settings.rendition_avif and features.check("avif") else ("webp",)
+if settings.rendition_avif and "avif" not in RENDITION_FORMATS:
+    print("[IMAGES] rendition_avif is on but this Pillow has no AVIF support, serving WebP only")
 
 # with multiple cns we can have it be modular were we can change easily 
 # also for deleting we can just delete the whole service
 # we will be using different cns services and logging it but we will not store locally
 
-# --- Image processing (threaded) ---
-def _process_image_sync(file_bytes, max_size=2048, to_webp=True):
-    img = Image.open(io.BytesIO(file_bytes))
-    
-    # Only convert if not already RGB
-    if img.mode != "RGB":
-        img = img.convert("RGB")
+# --- Image ingestion ---
+# Uploads arrive as starlette UploadFiles, which spool to disk past 1MB, so we
+# open the spooled file directly instead of reading it all into memory.
+# Image.open only parses the header, size and format are checked before any decode.
+ALLOWED_FORMATS = {"JPEG", "MPO", "PNG", "WEBP", "GIF"}
 
-    # Calculate new size once
-    img.thumbnail((max_size, max_size), Image.LANCZOS)
-    
-    img_format = "WEBP" if to_webp else "JPEG"
-    extension = "webp" if to_webp else "jpg"
+# Pillow's own decompression bomb guard (it raises at 2x this), backs up our pixel check
+Image.MAX_IMAGE_PIXELS = settings.max_image_pixels
 
+class UploadLimitMiddleware:
+    """
+    Plain ASGI middleware capping request bodies at settings.max_request_bytes,
+    by Content-Length up front and by counting chunks as they arrive, so an oversized
+    upload is refused before starlette spools it. The per image cap (_share,
+    _open_image) can only run once the form is parsed.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        max_bytes = settings.max_request_bytes
+        detail = f"Request larger than {max_bytes // (1024 * 1024)}MB"
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > max_bytes:
+            response = JSONResponse({"detail": detail}, status_code=413)
+            return await response(scope, receive, send)
+        received = 0
+
+        async def capped_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    # raised inside request.form(), fastapi turns it into the response
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, capped_receive, send)
+
+def _upload_size(fp) -> int:
+    pos = fp.tell()
+    fp.seek(0, io.SEEK_END)
+    size = fp.tell()
+    fp.seek(pos)
+    return size
+
+def _open_image(source, max_bytes=None, max_pixels=None):
+    """Open `source` (bytes or a file object) lazily, rejecting anything too big to decode."""
+    max_bytes = max_bytes or settings.max_upload_bytes
+    max_pixels = max_pixels or settings.max_image_pixels
+    fp = io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source
+    fp.seek(0)
+    if _upload_size(fp) > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Image larger than {max_bytes // (1024 * 1024)}MB")
+    try:
+        img = Image.open(fp)
+    except Image.DecompressionBombError:
+        raise HTTPException(status_code=413, detail="Image dimensions too large")
+    except UnidentifiedImageError:
+        raise HTTPException(status_code=415, detail="Unsupported image file")
+    if img.format not in ALLOWED_FORMATS:
+        raise HTTPException(status_code=415, detail=f"Unsupported image format: {img.format}")
+    width, height = img.size
+    if width * height > max_pixels:
+        raise HTTPException(status_code=413, detail="Image dimensions too large")
+    return img
+
+def _fit(img, max_size):
+    """Decode `img` scaled down to fit in max_size, doing as little full-res work as possible."""
+    with metrics.image_stage_duration.time(stage="decode"):
+        # JPEG: libjpeg decodes at 1/2, 1/4 or 1/8 scale directly (never smaller than
+        # the requested box, so ask for the aspect-correct target, not max_size square)
+        scale = min(1.0, max_size / max(img.size))
+        img.draft("RGB", (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+        if img.mode not in ("RGB", "L", "RGBA"):
+            # palette/odd modes can't be resampled properly, convert first
+            img = img.convert("RGB")
+        # reducing_gap: integer box reduce() first, LANCZOS only for the last step
+        img.thumbnail((max_size, max_size), Image.LANCZOS, reducing_gap=2.0)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img.load()  # small images skip resizing, make sure pixels are read before the file closes
+        return img
+
+# format -> (Pillow format, extension, save options)
+ENCODERS = {
+    "webp": ("WEBP", "webp", {"quality": 75, "method": 0}),  # method=0 is fastest
+    "jpeg": ("JPEG", "jpg", {"quality": 75, "optimize": False}),
+    "avif": ("AVIF", "avif", {"quality": settings.rendition_avif_quality, "speed": 8}),
+}
+
+def _encode_as(img, fmt: str):
+    img_format, extension, options = ENCODERS[fmt]
     buffer = io.BytesIO()
-    # Use method="fastest" for WebP, remove optimize for JPEG
-    if to_webp:
-        img.save(buffer, format=img_format, quality=75, method=0)  # method=0 is fastest
-    else:
-        img.save(buffer, format=img_format, quality=75, optimize=False)
-    
+    with metrics.image_stage_duration.time(stage="encode"):
+        img.save(buffer, format=img_format, **options)
     buffer.seek(0)
     return buffer, extension
 
-async def process_image(file_bytes, max_size=2048, to_webp=True):
-    return await asyncio.to_thread(_process_image_sync, file_bytes, max_size, to_webp)
-
-def _upload_sync(file_bytes, folder, extension, public_id=None):
-    upload_params = {
-        "folder": folder,
-        "resource_type": "image",
-        "format": extension,
-        "overwrite": False,
-        "invalidate": False,
-        "eager": [],  # Skip eager transformations
-        "notification_url": None,  # Skip webhook
-        "async": False,  # Ensure synchronous (default, but explicit)
-    }
-    
-    if public_id:
-        upload_params["public_id"] = public_id
-        upload_params["unique_filename"] = False
-    
-    return cloudinary.uploader.upload(file_bytes, **upload_params)
+def _encode(img, to_webp=True):
+    return _encode_as(img, "webp" if to_webp else "jpeg")
+
+# --- Image processing (worker processes, core/executors.py) ---
+# The upload goes to the worker through shared memory, the encoded result
+# (a fraction of the size) comes back pickled.
+def _process_image_sync(source, max_size=2048, to_webp=True):
+    with _open_image(source) as img:
+        return _encode(_fit(img, max_size), to_webp)
+
+def _process_renditions_sync(source, sizes, formats=("webp",)):
+    """
+    Decode `source` once (at the largest size) and step down through the smaller
+    ones, each resized from the previous. Returns ({size: {format: (buffer, extension, width)}},
+    dhash of the image). Sizes at or past the image's own size share one encode (the same objects).
+    """
+    out = {}
+    previous = None
+    current = None
+    phash = None
+    for size in sorted(set(sizes), reverse=True):
+        if current is None:
+            with _open_image(source) as img:
+                current = _fit(img, size)
+            phash = similar.dhash(current)
+        elif max(current.size) > size:
+            current = current.copy()
+            current.thumbnail((size, size), Image.LANCZOS)
+        if previous is None or previous[0] != current.size:
+            previous = current.size, {fmt: (*_encode_as(current, fmt), current.width) for fmt in formats}
+        out[size] = previous[1]
+    return out, phash
+
+def _process_image_shared(name, size, max_size, to_webp):
+    return _process_image_sync(read_shared(name, size), max_size, to_webp)
+
+def _process_renditions_shared(name, size, sizes, formats):
+    return _process_renditions_sync(read_shared(name, size), sizes, formats)
+
+async def _share(source) -> SharedBytes:
+    """Copy `source` (bytes or a spooled upload) into shared memory, checking the size first."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return SharedBytes(len(source)).write(source)
+    size = _upload_size(source)
+    if size > settings.max_upload_bytes:
+        raise HTTPException(status_code=413, detail=f"Image larger than {settings.max_upload_bytes // (1024 * 1024)}MB")
+    shared = SharedBytes(size)
+    try:
+        # spooled uploads past 1MB are on disk
+        return await io_executor.run(shared.read_from, source)
+    except BaseException:
+        shared.__exit__(None, None, None)
+        raise
+
+async def process_image(source, max_size=2048, to_webp=True):
+    with await _share(source) as shared:
+        return await image_executor.run(_process_image_shared, shared.name, shared.size, max_size, to_webp)
+
+async def process_renditions(source, sizes, formats=("webp",)):
+    with await _share(source) as shared:
+        return await image_executor.run(
+            _process_renditions_shared, shared.name, shared.size, tuple(sizes), tuple(formats)
+        )
 
 async def upload_image(file_obj, folder: str = "templates", max_size=2048):
-    file_bytes = await file_obj.read()
-    buffer, extension = await process_image(file_bytes, max_size=max_size)
-    
+    buffer, extension = await process_image(file_obj.file, max_size=max_size)
+    return await store_image(buffer, extension, folder)
+
+async def store_image(buffer, extension, folder: str = "templates"):
+    """Upload already processed bytes, skipping the upload if the asset index has them."""
     file_hash = hashlib.md5(buffer.getvalue()).hexdigest()[:12]
     public_id = f"{file_hash}"
-    
-    res = await asyncio.to_thread(_upload_sync, buffer, folder, extension, public_id)
-    return res["secure_url"], res["public_id"]
-
-async def delete_images(public_id: str, thumbnail_p_id: str):
-    loop = asyncio.get_running_loop()
-    result = await asyncio.gather(
-        loop.run_in_executor(None, cloudinary.uploader.destroy, public_id),
-        loop.run_in_executor(None, cloudinary.uploader.destroy, thumbnail_p_id),
-    )
-    return result
+
+    # content addressed: if these exact bytes were uploaded before, reuse them
+    # (the asset index uses its own short sessions so concurrent uploads don't share one)
+    async with database.AsyncSessionLocal() as db:
+        url = await crud.acquire_asset(db, f"{folder}/{public_id}")
+    if url:
+        return url, f"{folder}/{public_id}"
+
+    with metrics.image_stage_duration.time(stage="upload"):
+        secure_url, stored_id = await get_storage().upload(buffer.getvalue(), folder, public_id, extension)
+    async with database.AsyncSessionLocal() as db:
+        await crud.register_asset(db, stored_id, secure_url)
+    return secure_url, stored_id
+
+async def delete_images(*public_ids: str):
+    """
+    Release the given assets. Ones nothing references anymore are queued and
+    destroyed by the background worker (app/tasks.py), this never waits on storage.
+    """
+    async with database.AsyncSessionLocal() as db:
+        unreferenced = await crud.release_assets(db, public_ids)
+        await db.commit()
+    if unreferenced:
+        tasks.wake_asset_deletions()
+    return unreferenced
 
 async def update_image(cloudinary_public_id, file, folder="templates", max_size=2048):
-    # Delete old image if exists
+    # upload first so re-uploading the same image keeps its asset alive
+    url, public_id = await upload_image(file, folder, max_size)
+    # then release the old image
     if cloudinary_public_id:
         try:
-            cloudinary.uploader.destroy(cloudinary_public_id)
+            await delete_images(cloudinary_public_id)
         except Exception as e:
             # logging.warning(f"Failed to delete old image: {str(e)}")
             print(f"Failed to delete old image: {str(e)}")
-    return await upload_image(file, folder, max_size)
+    return url, public_id
 
-async def update_images(template_url, template_public_id, thumbnail_public_id, thumbnail_file):
+async def update_images(template_public_id, thumbnail_public_id, thumbnail_file):
     # call update_image directly since we only have one coroutine
     thumb_url, thumb_id = await update_image(
         thumbnail_public_id,
@@ -104,14 +249,72 @@ async def update_images(template_url, template_public_id, thumbnail_public_id, t
     )
 
     # return unpacked values
-    return template_url, template_public_id, thumb_url, thumb_id
+    return stored_url(template_public_id), template_public_id, thumb_url, thumb_id
 
-async def upload_images(template_file, thumbnail_file):
-    url, thumb = await asyncio.gather(
-        upload_image(template_file, folder="templates"),
-        upload_image(thumbnail_file, folder= THUMBNAIL, max_size=THUMBNAIL_SIZE)
-    )
-    return *url, *thumb
+async def upload_images(template_file, thumbnail_file=None):
+    """
+    One decode of `template_file` gives the main image, the thumbnail (unless
+    `thumbnail_file` is sent) and the rendition ladder, all uploaded concurrently.
+    Returns (image_url, image_id, thumb_url, thumb_id, renditions, rendition_ids, phash):
+    renditions is {format: {width: url}} for srcset, rendition_ids one asset reference
+    per ladder file (including the main image/thumbnail where the ladder reuses them),
+    phash the image's dHash (app/similar.py).
+    """
+    sizes = {IMAGE_SIZE, *RENDITION_SIZES}
+    if thumbnail_file is None:
+        sizes.add(THUMBNAIL_SIZE)
+    encoded, phash = await process_renditions(template_file.file, sizes, RENDITION_FORMATS)
+
+    # one store per distinct encode and folder (small sources give the same encode
+    # for several sizes), each store is one asset reference
+    stores = {}
+    def store(entry, folder):
+        key = (id(entry[0]), folder)
+        if key not in stores:
+            stores[key] = asyncio.ensure_future(store_image(entry[0], entry[1], folder))
+        return stores[key]
+
+    image_entry = encoded[IMAGE_SIZE]["webp"]
+    image = store(image_entry, "templates")
+    reuse = {id(image_entry[0]): image}
+    if thumbnail_file is None:
+        thumb_entry = encoded[THUMBNAIL_SIZE]["webp"]
+        thumb = store(thumb_entry, THUMBNAIL)
+        reuse.setdefault(id(thumb_entry[0]), thumb)
+    else:
+        thumb = asyncio.ensure_future(upload_image(thumbnail_file, folder=THUMBNAIL, max_size=THUMBNAIL_SIZE))
+    # where a rendition is byte for byte the main image or thumbnail, point at that instead
+    ladder = [
+        (fmt, size, reuse.get(id(encoded[size][fmt][0])) or store(encoded[size][fmt], RENDITIONS))
+        for size in RENDITION_SIZES for fmt in RENDITION_FORMATS
+    ]
+
+    pending = [image, thumb, *(task for task in stores.values() if task is not image and task is not thumb)]
+    results = await asyncio.gather(*pending, return_exceptions=True)
+    failed = [r for r in results if isinstance(r, BaseException)]
+    if failed:
+        # release what made it, nothing will point at it
+        await delete_images(*(r[1] for r in results if not isinstance(r, BaseException)))
+        raise failed[0]
+
+    image_url, image_id = image.result()
+    thumb_url, thumb_id = thumb.result()
+    renditions = {}
+    for fmt, size, task in ladder:
+        renditions.setdefault(fmt, {})[str(encoded[size][fmt][2])] = task.result()[0]
+    rendition_ids = [task.result()[1] for task in pending[2:]]
+    # ladder entries reusing the main image/thumbnail take their own reference, so
+    # replacing the thumbnail (update_images) can't destroy a file the srcset points at
+    reused = list(dict.fromkeys(task.result()[1] for _, _, task in ladder if task is image or task is thumb))
+    if reused:
+        try:
+            async with database.AsyncSessionLocal() as db:
+                await crud.acquire_assets(db, reused)
+        except BaseException:
+            await delete_images(*(r[1] for r in results))
+            raise
+        rendition_ids += reused
+    return image_url, image_id, thumb_url, thumb_id, renditions, rendition_ids, phash
 
 # async def upload_image_to_cloudinary(file: UploadFile, folder: str = "templates"):
 #     """Upload image and thumbnail to Cloudinary"""
@@ -124,7 +327,9 @@ async def upload_images(template_file, thumbnail_file):
 #         )
 
 
+def stored_url(public_id, extension="webp"):
+    """Url of a stored image, rebuilt from its id (templates and thumbnails are all encoded as webp)."""
+    return get_storage().url(public_id, extension)
+
 def get_public_id(url):
-    match = re.search(r"/upload/(?:v\d+/)?(.+)\.\w+$", url)
-    public_id = match.group(1) if match else None
-    return public_id
+    return get_storage().public_id_from_url(url) if url else None
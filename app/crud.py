@@ -1,21 +1,50 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from . import models, schemas
+from sqlalchemy.orm import load_only
+from . import models, schemas, similar
+from .search import apply_search
 from core import auth
-from sqlalchemy import delete, update, desc
+from core.settings import settings
+from sqlalchemy import ARRAY, DateTime, cast, String, bindparam, case, delete, exists, insert, literal, update, desc, tuple_, func, or_
+from datetime import timedelta
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from collections import Counter
+import math
 
 
 # --- USERS --- #
-async def create_user(db: AsyncSession, user_in: schemas.UserCreate):
-    hashed_pw = auth.hash_password(user_in.password)
-    db_user = models.User(
-        email=user_in.email,
-        username=user_in.username,
-        hashed_password=hashed_pw,
-    )
-    db.add(db_user)
+async def create_user(
+    db: AsyncSession,
+    user_in: schemas.UserCreate,
+    hashed_password: str | None = None,
+    username_candidates: list[str] | None = None,
+):
+    """
+    Insert a user in one statement, returns it or None if the email (or the
+    given username) is already taken. Without user_in.username the first of
+    `username_candidates` nobody has is picked by the insert itself, so there
+    is no check-then-insert race.
+    """
+    hashed_pw = hashed_password or await auth.hash_password_async(user_in.password)
+    row = {"email": user_in.email, "hashed_password": hashed_pw, "is_active": True, "is_superuser": False, "is_staff": False}
+    if user_in.username or not username_candidates:
+        stmt = pg_insert(models.User).values(username=user_in.username, **row)
+    else:
+        names = (
+            func.unnest(bindparam("username_candidates", list(username_candidates), type_=ARRAY(String)))
+            .table_valued("name")
+            .render_derived(name="candidates")
+        )
+        free = (
+            select(*(literal(v) for v in row.values()), names.c.name)
+            .where(~exists().where(models.User.username == names.c.name))
+            .limit(1)
+        )
+        stmt = pg_insert(models.User).from_select([*row, "username"], free)
+    stmt = stmt.on_conflict_do_nothing().returning(models.User)
+    result = await db.execute(select(models.User).from_statement(stmt))
+    db_user = result.scalar_one_or_none()
     await db.commit()
-    await db.refresh(db_user)
     return db_user
 
 
@@ -38,6 +67,11 @@ async def get_user_by_id(db: AsyncSession, user_id: int):
     return result.scalar_one_or_none()
 
 
+def _only(model, columns):
+    # anything not selected raises instead of lazy loading (which can't happen in async anyway)
+    return load_only(*(getattr(model, c) for c in columns), raiseload=True)
+
+
 # --- TEMPLATES --- #
 async def create_template(
     db: AsyncSession,
@@ -47,6 +81,9 @@ async def create_template(
     image_public_id: str,
     thumbnail_url: str,
     thumbnail_public_id: str,
+    renditions: dict | None = None,
+    rendition_public_ids: list[str] | None = None,
+    phash: int | None = None,
 ):
     text_list = [t.model_dump() if hasattr(t, "model_dump") else dict(t) for t in template_in.text_elements]
     db_t = models.Template(
@@ -59,8 +96,13 @@ async def create_template(
         image_public_id=image_public_id,
         owner_id=owner_id,
         thumbnail_public_id=thumbnail_public_id,
+        renditions=renditions,
+        rendition_public_ids=rendition_public_ids,
+        phash=similar.to_db(phash) if phash is not None else None,
     )
     db.add(db_t)
+    await db.flush()  # for the id
+    await set_template_tags(db, db_t.id, normalize_tags(template_in.tag))
     await db.commit()
     return {
         "id": db_t.id,
@@ -71,6 +113,7 @@ async def create_template(
         "thumbnail_url": thumbnail_url,
         "text_elements": text_list,
         "tag":template_in.tag,
+        "renditions": renditions,
         "created_at": db_t.created_at
     }
 
@@ -81,46 +124,126 @@ async def update_template(db: AsyncSession, template_id: int, update_data: dict,
         # optional owner check
         # .where((models.Template.owner_id == current_user.id) | current_user.is_superuser)
         .values(**update_data)
+        .returning(models.Template.id)
         .execution_options(synchronize_session="fetch")
     )
     result = await db.execute(stmt)
+    if result.scalar_one_or_none() is None:
+        await db.rollback()
+        return False
+    if "tag" in update_data:
+        await set_template_tags(db, template_id, normalize_tags(update_data["tag"]))
     await db.commit()
-    return result
+    return True
 
 async def delete_template(db: AsyncSession, template_id, current_user):
+    """
+    Delete a template (variants go with it through the FK cascade) and release
+    every image they referenced in the same transaction. Returns False if
+    nothing was deleted.
+    """
+    variant_thumbs = await db.execute(
+        select(models.Variant.thumbnail_public_id).where(models.Variant.source_id == template_id)
+    )
+    # the FK cascade would drop these too, but the tag counts have to follow
+    await set_template_tags(db, template_id, [])
     stmt = (
         delete(models.Template)
         .where(
             models.Template.id == template_id,
             # ((models.Template.owner_id == current_user.id) | current_user.is_superuser)
         )
+        .returning(
+            models.Template.image_public_id,
+            models.Template.thumbnail_public_id,
+            models.Template.rendition_public_ids,
+        )
         .execution_options(synchronize_session="fetch")
     )
 
     result = await db.execute(stmt)
+    deleted = result.one_or_none()
+    if deleted is None:
+        await db.rollback()
+        return False
+    image_id, thumb_id, rendition_ids = deleted
+    await release_assets(db, [image_id, thumb_id, *(rendition_ids or []), *variant_thumbs.scalars().all()])
     await db.commit()    
-    return result
+    return True
+
+# ?sort= -> the column keyset pagination runs on (with id as tie breaker)
+SORT_COLUMNS = {
+    "recent": models.Template.created_at,
+    "trending": models.Template.trending_score,
+    "popular": models.Template.variant_count,
+}
 
 async def list_templates(
     db: AsyncSession,
     skip: int = 0,
     limit: int = 10,
     search: str | None = None,
-    tag: str | None = None,
+    tags: list[str] | None = None,
+    tag_mode: str = "all",
+    after: tuple | None = None,
+    columns: list[str] | None = None,
+    sort: str = "recent",
 ):
+    """
+    Returns (templates, next_key). Without a search the listing is keyset
+    paginated on (sort column, id), newest/highest first: pass the previous
+    next_key as `after`. Search results are relevance ranked and only
+    support skip/limit. `columns` restricts the select to those columns
+    (plus the page key). `tags` (normalized) keeps templates having all of
+    them, or any of them with tag_mode="any".
+    """
+    sort_column = SORT_COLUMNS[sort]
     stmt = select(models.Template)
+    if columns is not None:
+        stmt = stmt.options(_only(models.Template, {*columns, "id", sort_column.key}))
+    if tags:
+        stmt = stmt.where(_tag_filter(tags, tag_mode))
+
     if search:
-        stmt = stmt.where(
-            models.Template.name.ilike(f"%{search}%")
-            | models.Template.description.ilike(f"%{search}%")
-        )
-    if tag:
-        stmt = stmt.where(models.Template.tag.ilike(f"%{tag}%"))
+        # relevance ranked, see app/search.py
+        stmt = apply_search(stmt, search)
+        result = await db.execute(stmt.offset(skip).limit(limit))
+        return result.scalars().all(), None
 
-    stmt = stmt.order_by(desc(models.Template.created_at))
+    # matches ix_templates_created_at_id / _trending_id / _variant_count_id,
+    # so every page is an index range scan
+    if after is not None:
+        stmt = stmt.where(tuple_(sort_column, models.Template.id) < after)
+    elif skip:
+        stmt = stmt.offset(skip)
+    stmt = stmt.order_by(desc(sort_column), desc(models.Template.id))
 
-    result = await db.execute(stmt.offset(skip).limit(limit))
-    return result.scalars().all()
+    result = await db.execute(stmt.limit(limit + 1))
+    items = result.scalars().all()
+    if len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    return items, (getattr(items[-1], sort_column.key), items[-1].id)
+
+async def get_templates_by_ids(db: AsyncSession, ids: list[int], columns: list[str] | None = None):
+    """Templates for `ids` in one IN query, in the order asked for. Unknown ids are skipped."""
+    stmt = select(models.Template).where(models.Template.id.in_(set(ids)))
+    if columns is not None:
+        stmt = stmt.options(_only(models.Template, {*columns, "id"}))
+    result = await db.execute(stmt)
+    by_id = {t.id: t for t in result.scalars()}
+    return [by_id[i] for i in dict.fromkeys(ids) if i in by_id]
+
+async def iter_phashes(db: AsyncSession, after_id: int = 0, batch_size: int = 10000):
+    """Batches of (template_id, unsigned phash) for templates past after_id, streamed (app/similar.py index)."""
+    result = await db.stream(
+        select(models.Template.id, models.Template.phash)
+        .where(models.Template.id > after_id, models.Template.phash.is_not(None))
+        .order_by(models.Template.id)
+        .execution_options(yield_per=batch_size)
+    )
+    async for rows in result.partitions():
+        yield [(template_id, similar.from_db(value)) for template_id, value in rows]
 
 async def get_template(db: AsyncSession, template_id: int):
      # fetch updated row if you need to return it
@@ -129,6 +252,109 @@ async def get_template(db: AsyncSession, template_id: int):
     )
     return result.scalar_one_or_none()
 
+# --- TAGS --- #
+# Template.tag stays as entered, the normalized tags live in tags/template_tags
+TAG_MAX_LENGTH = 50
+
+def normalize_tags(raw) -> list[str]:
+    """Comma separated tags, lowercased, whitespace collapsed and deduped: "Cats, reaction ,CATS" -> ["cats", "reaction"]."""
+    if not raw:
+        return []
+    parts = raw.split(",") if isinstance(raw, str) else raw
+    names = (" ".join(part.split()).lower()[:TAG_MAX_LENGTH].rstrip() for part in parts)
+    return list(dict.fromkeys(name for name in names if name))
+
+async def set_template_tags(db: AsyncSession, template_id: int, names: list[str]):
+    """
+    Make `names` the template's tags, moving tags.template_count by exactly the
+    links added/removed (RETURNING, so concurrent edits can't double count).
+    Doesn't commit.
+    """
+    tt, Tag = models.template_tags, models.Tag
+    removed = await db.execute(
+        delete(tt)
+        .where(tt.c.template_id == template_id, tt.c.tag_id.not_in(select(Tag.id).where(Tag.name.in_(names))))
+        .returning(tt.c.tag_id)
+    )
+    removed = removed.scalars().all()
+    if removed:
+        await db.execute(
+            update(Tag).where(Tag.id.in_(removed)).values(template_count=func.greatest(Tag.template_count - 1, 0))
+        )
+    if not names:
+        return
+    await db.execute(pg_insert(Tag).values([{"name": n} for n in names]).on_conflict_do_nothing(index_elements=["name"]))
+    added = await db.execute(
+        pg_insert(tt)
+        .from_select(["template_id", "tag_id"], select(literal(template_id), Tag.id).where(Tag.name.in_(names)))
+        .on_conflict_do_nothing()
+        .returning(tt.c.tag_id)
+    )
+    added = added.scalars().all()
+    if added:
+        await db.execute(update(Tag).where(Tag.id.in_(added)).values(template_count=Tag.template_count + 1))
+
+def _tag_filter(names: list[str], mode: str = "all"):
+    # semi join on ix_template_tags_tag_id_template_id, "all" = every tag matched
+    tt = models.template_tags
+    matching = select(tt.c.template_id).join(models.Tag, models.Tag.id == tt.c.tag_id).where(models.Tag.name.in_(names))
+    if mode == "all" and len(names) > 1:
+        matching = matching.group_by(tt.c.template_id).having(func.count() == len(names))
+    return models.Template.id.in_(matching)
+
+async def list_tags(db: AsyncSession, limit: int = 50, prefix: str | None = None):
+    """(name, template_count) rows, most used first. Counts are stored, nothing is counted here."""
+    Tag = models.Tag
+    stmt = select(Tag.name, Tag.template_count).where(Tag.template_count > 0)
+    if prefix:
+        stmt = stmt.where(Tag.name.startswith(prefix, autoescape=True))
+    result = await db.execute(stmt.order_by(desc(Tag.template_count), Tag.name).limit(limit))
+    return result.all()
+
+
+# --- POPULARITY --- #
+# trending_score is a variant count where each variant's weight halves every
+# trending_half_life_hours, stored as log(score at t) + t/tau. That's the same
+# number whatever t it's computed at, so decay never rewrites a row and the
+# (trending_score, id) keyset stays valid between pages: ordering by it is
+# ordering by the score now. 0 is "no score" (a real one is around now/tau,
+# tens of thousands). Changing the half life skews old rows against new ones
+# until they next change.
+def _trending_tau() -> float:
+    return settings.trending_half_life_hours * 3600 / math.log(2)
+
+def _trending_key(ts):
+    """The stored key of a single variant created at `ts` (timestamp without time zone, like the columns)."""
+    return func.extract("epoch", ts) / _trending_tau()
+
+_NOW = cast(func.now(), DateTime)
+
+def _logaddexp(a, b):
+    # log(exp(a) + exp(b)) without overflowing (and postgres errors on exp() underflow)
+    return func.greatest(a, b) + func.ln(1 + func.exp(-func.least(func.abs(a - b), 700)))
+
+def _logsubexp(a, b):
+    """log(exp(a) - exp(b)), 0 (no score) when that's nothing or under trending_score_floor."""
+    diff = a - b
+    remaining = a + func.ln(1 - func.exp(-func.least(diff, 700)))
+    below_floor = remaining - _trending_key(_NOW) < math.log(settings.trending_score_floor)
+    return case((diff <= 1e-9, 0.0), (below_floor, 0.0), else_=remaining)
+
+async def bump_popularity(db: AsyncSession, counts: dict[int, int]):
+    """Add `n` fresh variants to each template id in `counts`. Doesn't commit."""
+    for template_id, n in counts.items():
+        await db.execute(
+            update(models.Template)
+            .where(models.Template.id == template_id)
+            .values(
+                variant_count=models.Template.variant_count + n,
+                trending_score=_logaddexp(models.Template.trending_score, _trending_key(_NOW) + math.log(n)),
+                trending_updated_at=func.now(),
+                updated_at=models.Template.updated_at,  # not an edit of the template
+            )
+        )
+
+
 # --- VARIANTS --- #
 async def create_variant(
     db: AsyncSession,
@@ -136,6 +362,7 @@ async def create_variant(
     thumb_id: str,
     owner_id: int,
     variant_in: schemas.VariantCreate,
+    render_hash: str | None = None,
 ):
     text_list = [t.model_dump() if hasattr(t, "model_dump") else dict(t) for t in variant_in.text_elements]
     db_v = models.Variant(
@@ -144,8 +371,10 @@ async def create_variant(
         source_id=variant_in.source_id,
         thumbnail_url=thumb_url,
         thumbnail_public_id=thumb_id,
+        render_hash=render_hash,
     )
     db.add(db_v)
+    await bump_popularity(db, {variant_in.source_id: 1})
     await db.commit()
     return {
         "id": db_v.id,
@@ -156,7 +385,274 @@ async def create_variant(
     }
 
 
-async def list_variants_for_template(db: AsyncSession, template_id: int, skip: int = 0, limit: int = 10):
-    stmt = select(models.Variant).where(models.Variant.source_id == template_id).offset(skip).limit(limit)
+async def create_variants(db: AsyncSession, owner_id: int, rows: list[dict]):
+    """
+    Insert many variants with one multi-row INSERT ... RETURNING. Each row has
+    thumb_url, thumb_id, variant_in and render_hash, results come back in input order.
+    """
+    values = [
+        {
+            "text_elements": [t.model_dump() for t in row["variant_in"].text_elements],
+            "owner_id": owner_id,
+            "source_id": row["variant_in"].source_id,
+            "thumbnail_url": row["thumb_url"],
+            "thumbnail_public_id": row["thumb_id"],
+            "render_hash": row.get("render_hash"),
+        }
+        for row in rows
+    ]
+    stmt = insert(models.Variant).returning(models.Variant.id, sort_by_parameter_order=True)
+    result = await db.execute(stmt, values)
+    ids = result.scalars().all()
+    await bump_popularity(db, Counter(v["source_id"] for v in values))
+    await db.commit()
+    return [
+        {
+            "id": variant_id,
+            "owner_id": owner_id,
+            "source_id": v["source_id"],
+            "thumbnail_url": v["thumbnail_url"],
+            "text_elements": v["text_elements"],
+        }
+        for variant_id, v in zip(ids, values)
+    ]
+
+
+async def get_variant(db: AsyncSession, variant_id: int):
+    result = await db.execute(select(models.Variant).where(models.Variant.id == variant_id))
+    return result.scalar_one_or_none()
+
+
+async def delete_variant(db: AsyncSession, variant_id: int) -> bool:
+    """
+    Delete a variant, take it back out of its template's counters and release
+    its thumbnail, all in one transaction. Returns False if nothing was deleted.
+    """
+    result = await db.execute(
+        delete(models.Variant)
+        .where(models.Variant.id == variant_id)
+        .returning(models.Variant.source_id, models.Variant.thumbnail_public_id, models.Variant.created_at)
+    )
+    deleted = result.one_or_none()
+    if deleted is None:
+        await db.rollback()
+        return False
+    source_id, thumb_id, created_at = deleted
+    # take out what this variant weighs in the score (variants from before created_at existed weigh 0)
+    score = models.Template.trending_score
+    if created_at:
+        score = _logsubexp(score, _trending_key(literal(created_at, DateTime)))
+    await db.execute(
+        update(models.Template)
+        .where(models.Template.id == source_id)
+        .values(
+            variant_count=func.greatest(models.Template.variant_count - 1, 0),
+            trending_score=score,
+            trending_updated_at=func.now(),
+            updated_at=models.Template.updated_at,
+        )
+    )
+    await release_assets(db, [thumb_id])
+    await db.commit()
+    return True
+
+
+async def get_variant_thumbnails_by_hash(db: AsyncSession, render_hashes) -> dict:
+    """{render_hash: (thumbnail_url, thumbnail_public_id)} for the hashes any variant has."""
+    if not render_hashes:
+        return {}
+    # newest variant per hash
+    latest = (
+        select(func.max(models.Variant.id))
+        .where(models.Variant.render_hash.in_(set(render_hashes)))
+        .group_by(models.Variant.render_hash)
+    )
+    stmt = (
+        select(models.Variant.render_hash, models.Variant.thumbnail_url, models.Variant.thumbnail_public_id)
+        .where(models.Variant.id.in_(latest))
+    )
+    result = await db.execute(stmt)
+    return {key: (url, public_id) for key, url, public_id in result.tuples()}
+
+
+async def list_variants_for_template(
+    db: AsyncSession,
+    template_id: int,
+    skip: int = 0,
+    limit: int = 10,
+    after: int | None = None,
+    columns: list[str] | None = None,
+):
+    """Returns (variants, next_key), newest first, keyset paginated on id."""
+    stmt = select(models.Variant).where(models.Variant.source_id == template_id)
+    if columns is not None:
+        stmt = stmt.options(_only(models.Variant, {*columns, "id"}))
+    if after is not None:
+        stmt = stmt.where(models.Variant.id < after)
+    elif skip:
+        stmt = stmt.offset(skip)
+    stmt = stmt.order_by(desc(models.Variant.id))
+
+    result = await db.execute(stmt.limit(limit + 1))
+    items = result.scalars().all()
+    if len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    return items, (items[-1].id,)
+
+
+# --- ASSETS --- #
+# An asset nothing references keeps its row (refcount 0) while it waits in
+# asset_deletions. The deletion worker locks that row across the storage destroy
+# and deletes it after, so taking a reference either revives the asset before
+# the worker claims it, or waits for the destroy and finds no row (re-upload).
+async def acquire_asset(db: AsyncSession, public_id: str) -> str | None:
+    """Take a reference on an already uploaded asset, returns its url or None if unknown."""
+    stmt = (
+        update(models.Asset)
+        .where(models.Asset.public_id == public_id)
+        .values(refcount=func.greatest(models.Asset.refcount, 0) + 1, updated_at=func.now())
+        .returning(models.Asset.secure_url)
+    )
+    result = await db.execute(stmt)
+    await db.commit()
+    return result.scalar_one_or_none()
+
+async def acquire_assets(db: AsyncSession, public_ids) -> set[str]:
+    """acquire_asset for many ids (ids may repeat), returns the ones that exist."""
+    counts = Counter(pid for pid in public_ids if pid)
+    by_count = {}
+    for pid, n in counts.items():
+        by_count.setdefault(n, []).append(pid)
+    acquired = set()
+    for n, pids in by_count.items():
+        result = await db.execute(
+            update(models.Asset)
+            .where(models.Asset.public_id.in_(pids))
+            .values(refcount=func.greatest(models.Asset.refcount, 0) + n, updated_at=func.now())
+            .returning(models.Asset.public_id)
+        )
+        acquired.update(result.scalars().all())
+    await db.commit()
+    return acquired
+
+async def register_asset(db: AsyncSession, public_id: str, secure_url: str):
+    """Record a fresh upload with one reference (or add one if a concurrent upload won the race)."""
+    stmt = pg_insert(models.Asset).values(public_id=public_id, secure_url=secure_url, refcount=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.Asset.public_id],
+        set_={"refcount": func.greatest(models.Asset.refcount, 0) + 1, "secure_url": secure_url, "updated_at": func.now()},
+    )
+    # a queued deletion of this id is dropped by claim_asset_deletions (refcount > 0),
+    # not here: touching the queue row after the asset row could deadlock with the worker
+    await db.execute(stmt)
+    await db.commit()
+
+async def release_assets(db: AsyncSession, public_ids) -> list[str]:
+    """
+    Drop one reference per id (ids may repeat). Ids nothing points at anymore
+    (or that predate the index) are queued in asset_deletions and returned,
+    their asset rows stay at refcount 0 until the file is destroyed.
+    Doesn't commit, so it can share a transaction with the row delete.
+    """
+    counts = Counter(pid for pid in public_ids if pid)
+    if not counts:
+        return []
+
+    known = {}
+    by_count = {}
+    for pid, n in counts.items():
+        by_count.setdefault(n, []).append(pid)
+    for n, pids in by_count.items():
+        result = await db.execute(
+            update(models.Asset)
+            .where(models.Asset.public_id.in_(pids))
+            .values(refcount=models.Asset.refcount - n, updated_at=func.now())
+            .returning(models.Asset.public_id, models.Asset.refcount)
+        )
+        known.update(result.tuples().all())
+
+    dead = [pid for pid, refcount in known.items() if refcount <= 0]
+    # ids that predate the index have no row to lock, their random names can't
+    # come back through a content-addressed upload either
+    dead += [pid for pid in counts if pid not in known]
+    await enqueue_asset_deletions(db, dead)
+    return dead
+
+async def enqueue_asset_deletions(db: AsyncSession, public_ids: list[str]):
+    if not public_ids:
+        return
+    stmt = pg_insert(models.AssetDeletion).values([{"public_id": pid} for pid in public_ids])
+    await db.execute(stmt.on_conflict_do_nothing(index_elements=[models.AssetDeletion.public_id]))
+
+async def claim_asset_deletions(db: AsyncSession, limit: int):
+    """
+    Due deletions, row locked (SKIP LOCKED) so several workers can drain in parallel.
+    Their asset rows are locked too, until the caller commits: hold the transaction
+    open across the destroy and delete the asset rows with the queue rows.
+    """
+    # an id that got a reference again since it was queued is alive, drop it from the queue
+    await db.execute(
+        delete(models.AssetDeletion)
+        .where(models.AssetDeletion.public_id.in_(select(models.Asset.public_id).where(models.Asset.refcount > 0)))
+    )
+    stmt = (
+        select(models.AssetDeletion)
+        .where(models.AssetDeletion.next_attempt_at <= func.now())
+        .order_by(models.AssetDeletion.next_attempt_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
     result = await db.execute(stmt)
-    return result.scalars().all()
+    rows = result.scalars().all()
+    if not rows:
+        return rows
+    # acquire_asset/register_asset on these ids now wait for our commit; one that
+    # got its reference in between the two statements above is alive after all
+    locked = await db.execute(
+        select(models.Asset.public_id, models.Asset.refcount)
+        .where(models.Asset.public_id.in_([row.public_id for row in rows]))
+        .order_by(models.Asset.public_id)
+        .with_for_update()
+    )
+    revived = {public_id for public_id, refcount in locked.tuples() if refcount > 0}
+    if revived:
+        await db.execute(delete(models.AssetDeletion).where(models.AssetDeletion.public_id.in_(revived)))
+    return [row for row in rows if row.public_id not in revived]
+
+async def sweep_orphan_assets(db: AsyncSession, grace_seconds: int) -> int:
+    """
+    Queue assets no template, rendition or variant references anymore, e.g. left behind
+    by a crash between upload and insert. `grace_seconds` keeps in-flight
+    uploads (acquired but not inserted yet) out of the sweep.
+    """
+    # one anti join per referencing column, each an index probe (the *_public_id
+    # indexes, and the jsonb_path_ops GIN one for the ladder ids)
+    public_id = models.Asset.public_id
+    referenced = or_(
+        exists().where(models.Template.image_public_id == public_id),
+        exists().where(models.Template.thumbnail_public_id == public_id),
+        exists().where(models.Variant.thumbnail_public_id == public_id),
+        exists().where(models.Template.rendition_public_ids.contains(func.jsonb_build_array(public_id))),
+    )
+    orphans = (
+        update(models.Asset)
+        .where(
+            models.Asset.updated_at < func.now() - timedelta(seconds=grace_seconds),
+            (models.Asset.refcount <= 0) | ~referenced,
+            ~exists().where(models.AssetDeletion.public_id == models.Asset.public_id),
+        )
+        .values(refcount=0)  # the row stays until the file is destroyed, see claim_asset_deletions
+        .returning(models.Asset.public_id)
+        .cte("orphans")
+    )
+    stmt = (
+        pg_insert(models.AssetDeletion)
+        .from_select(["public_id"], select(orphans.c.public_id))
+        .on_conflict_do_nothing(index_elements=[models.AssetDeletion.public_id])
+        .returning(models.AssetDeletion.public_id)
+    )
+    result = await db.execute(stmt)
+    swept = len(result.all())
+    await db.commit()
+    return swept
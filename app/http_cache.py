@@ -0,0 +1,146 @@
+# app/http_cache.py
+import hashlib
+import time
+import uuid
+from urllib.parse import urlencode
+from fastapi import Request, Response, status
+from sqlalchemy import func, select
+from core.cache import TTLCache
+from core.settings import settings
+from . import database
+
+# Response cache for the template read endpoints. Entries are tagged
+# ("templates", "template:5", "variants:5") and the write paths in
+# app/routes.py drop every tag they touch. The cache is per process: the
+# dropped tags go out to every other worker (and host) with a postgres NOTIFY
+# on INVALIDATION_CHANNEL, which tasks.run_cache_invalidations listens to.
+# A worker only caches while its listener is connected, so one that may have
+# missed a notification never serves from the cache.
+INVALIDATION_CHANNEL = "http_cache_invalidate"
+_NOTIFY_MAX_BYTES = 7000  # postgres caps a NOTIFY payload at 8000
+_responses = TTLCache(maxsize=settings.response_cache_size, ttl=settings.response_cache_ttl)
+_keys_by_tag: dict[str, set[str]] = {}
+_version = 0  # bumped on every invalidation
+_invalidated_at = 0.0
+_origin = uuid.uuid4().hex  # this process, its own notifications are skipped
+_listening = False
+
+
+class CachedBody:
+    __slots__ = ("body", "etag", "headers")
+
+    def __init__(self, body: bytes, headers: dict | None = None):
+        self.body = body
+        self.etag = make_etag(body)
+        self.headers = headers or {}
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def cache_key(request: Request) -> str:
+    # sorted so ?limit=5&skip=0 and ?skip=0&limit=5 share an entry
+    return request.url.path + "?" + urlencode(sorted(request.query_params.multi_items()))
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in (t.strip() for t in if_none_match.split(","))
+
+
+def build_response(request: Request, entry: CachedBody) -> Response:
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache", **entry.headers}
+    if _not_modified(request, entry.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+class CacheLookup:
+    """Result of `lookup`, either a ready response or a way to store one."""
+
+    def __init__(self, request: Request):
+        self.request = request
+        self.key = cache_key(request)
+        self.version = _version
+        self.enabled = _listening
+        entry = _responses.get(self.key) if self.enabled else None
+        self.response = build_response(request, entry) if entry is not None else None
+
+    def store(self, body: bytes, tags: list[str], headers: dict | None = None) -> Response:
+        entry = CachedBody(body, headers)
+        # a write landed while we were reading, the body may already be stale
+        # (same if it was read from a replica that may not have that write yet)
+        lagging = getattr(self.request.state, "db_replica", False) and (
+            time.monotonic() - _invalidated_at < settings.replica_sticky_seconds
+        )
+        if self.enabled and self.version == _version and not lagging:
+            _responses.set(self.key, entry)
+            for tag in tags:
+                keys = _keys_by_tag.setdefault(tag, set())
+                if len(keys) > 2 * _responses.maxsize:
+                    keys.difference_update([k for k in keys if k not in _responses])
+                keys.add(self.key)
+        return build_response(self.request, entry)
+
+
+def lookup(request: Request) -> CacheLookup:
+    return CacheLookup(request)
+
+
+def invalidate_local(*tags: str):
+    global _version, _invalidated_at
+    _version += 1
+    _invalidated_at = time.monotonic()
+    for tag in tags:
+        for key in _keys_by_tag.pop(tag, ()):
+            _responses.pop(key)
+
+
+async def invalidate(*tags: str):
+    """Drop `tags` here and in every other worker. Call it after the write committed, before responding."""
+    invalidate_local(*tags)
+    try:
+        async with database.AsyncSessionLocal() as db:
+            for payload in _payloads(tags):
+                await db.execute(select(func.pg_notify(INVALIDATION_CHANNEL, payload)))
+            await db.commit()
+    except Exception as e:
+        # the write went through, other workers serve the old body for up to response_cache_ttl
+        print(f"[CACHE] ❌ Publishing invalidation of {', '.join(tags)} failed: {e}")
+
+
+def _payloads(tags):
+    """'<origin> tag,tag,...' chunks that each fit in a NOTIFY."""
+    chunk = []
+    size = 0
+    for tag in tags:
+        if chunk and size + len(tag) + 1 > _NOTIFY_MAX_BYTES:
+            yield f"{_origin} {','.join(chunk)}"
+            chunk, size = [], 0
+        chunk.append(tag)
+        size += len(tag) + 1
+    if chunk:
+        yield f"{_origin} {','.join(chunk)}"
+
+
+def apply_notification(payload: str):
+    """Invalidation published by another worker (tasks.run_cache_invalidations)."""
+    origin, _, tags = payload.partition(" ")
+    if origin != _origin and tags:
+        invalidate_local(*tags.split(","))
+
+
+def set_listening(listening: bool):
+    """Cache only while invalidations from other workers are being received."""
+    global _listening, _version
+    _listening = listening
+    _version += 1  # reads in flight may have missed a notification, don't store them
+    _responses.clear()
+    _keys_by_tag.clear()
+
+
+def stats() -> dict:
+    return _responses.stats()
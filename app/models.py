@@ -1,7 +1,7 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Text, DateTime
-from sqlalchemy.orm import relationship
+from sqlalchemy import BigInteger, Column, Integer, String, Boolean, ForeignKey, Text, DateTime, Float, Computed, Index, Table
+from sqlalchemy.orm import relationship, deferred
 from .database import Base
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.sql import func
 
 # USERS
@@ -20,6 +20,11 @@ class User(Base):
 
 
 # TEMPLATES
+SEARCH_DOCUMENT = (
+    "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'B')"
+)
+
 class Template(Base):
     __tablename__ = "templates"
 
@@ -27,17 +32,78 @@ class Template(Base):
     name = Column(String, index=True, nullable=False)
     description = Column(Text, nullable=True)
     text_elements = Column(JSONB, nullable=True, default=list)
-    tag = Column(String, index=True, nullable=True)
+    tag = Column(String, index=True, nullable=True)  # as entered, "tags" is the normalized form
     image_url = Column(String, nullable=False)
     image_public_id = Column(String, nullable=False)
     thumbnail_url = Column(String, nullable=False)
     thumbnail_public_id = Column(String, nullable=False)
+    # {"webp": {"256": url, ...}, "avif": {...}} keyed by actual width, for srcset
+    # (app/cloud.upload_images), and one asset reference per file the renditions point at
+    renditions = Column(JSONB, nullable=True)
+    rendition_public_ids = Column(JSONB, nullable=True)
+    # 64-bit dHash of the image (app/similar.py), stored signed
+    phash = Column(BigInteger, nullable=True)
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     owner = relationship("User", back_populates="templates")
     variants = relationship("Variant", back_populates="source", cascade="all, delete-orphan")
 
+    # popularity, kept up to date by crud.create_variant/delete_variant. trending_score
+    # is an exponentially decayed variant count kept in log space so it never needs
+    # re-decaying (see crud.py), trending_updated_at when it last changed
+    variant_count = Column(Integer, nullable=False, default=0, server_default="0")
+    trending_score = Column(Float, nullable=False, default=0.0, server_default="0")
+    trending_updated_at = Column(DateTime, default=func.now(), server_default=func.now())
+
+    # full-text search document, kept up to date by postgres (see app/search.py)
+    search_vector = deferred(Column(TSVECTOR, Computed(SEARCH_DOCUMENT, persisted=True)))
+
+    __table_args__ = (
+        Index("ix_templates_search_vector", "search_vector", postgresql_using="gin"),
+        # needs the pg_trgm extension (created on startup)
+        Index("ix_templates_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+        # keyset pagination of the gallery, newest first
+        Index("ix_templates_created_at_id", created_at.desc(), id.desc()),
+        # ?sort=trending and ?sort=popular
+        Index("ix_templates_trending_id", trending_score.desc(), id.desc()),
+        Index("ix_templates_variant_count_id", variant_count.desc(), id.desc()),
+        # asset references, probed by crud.sweep_orphan_assets
+        Index("ix_templates_image_public_id", "image_public_id"),
+        Index("ix_templates_thumbnail_public_id", "thumbnail_public_id"),
+        Index(
+            "ix_templates_rendition_public_ids", "rendition_public_ids",
+            postgresql_using="gin", postgresql_ops={"rendition_public_ids": "jsonb_path_ops"},
+        ),
+    )
+
+# TAGS
+# Template.tag split on commas and normalized (crud.normalize_tags), one row per
+# distinct tag. template_count is kept up to date by crud.set_template_tags and
+# crud.delete_template so GET /tags never has to count.
+class Tag(Base):
+    __tablename__ = "tags"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50), unique=True, nullable=False)
+    template_count = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        # GET /tags, most used first
+        Index("ix_tags_template_count_name", template_count.desc(), "name"),
+        # GET /tags?prefix= (LIKE 'abc%' can't use the unique index under a non-C collation)
+        Index("ix_tags_name_pattern", "name", postgresql_ops={"name": "varchar_pattern_ops"}),
+    )
+
+template_tags = Table(
+    "template_tags",
+    Base.metadata,
+    Column("template_id", Integer, ForeignKey("templates.id", ondelete="CASCADE"), primary_key=True),
+    Column("tag_id", Integer, ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True),
+    # the primary key covers "tags of a template", this one "templates with a tag"
+    Index("ix_template_tags_tag_id_template_id", "tag_id", "template_id"),
+)
+
 # defer the public key when not needed
 # VARIANTS
 class Variant(Base):
@@ -54,8 +120,48 @@ class Variant(Base):
 
     source_id = Column(Integer, ForeignKey("templates.id", ondelete="CASCADE"))
     source = relationship("Template", back_populates="variants")
+
+    created_at = Column(DateTime, default=func.now())
+
+    # canonical hash of a server render: source_id, scale and text_elements (app/render.variant_key),
+    # NULL for client uploads
+    render_hash = Column(String(64), index=True, nullable=True)
+
+    __table_args__ = (
+        # keyset pagination of a template's variants
+        Index("ix_variants_source_id_id", "source_id", "id"),
+        # asset references, probed by crud.sweep_orphan_assets
+        Index("ix_variants_thumbnail_public_id", "thumbnail_public_id"),
+    )
     
 
+
+# ASSETS
+# Index of uploaded images keyed by their content-addressed public id,
+# so identical uploads are reused and only destroyed once nothing points at them.
+# Rows at refcount 0 are queued in asset_deletions, they go when the file does.
+class Asset(Base):
+    __tablename__ = "assets"
+
+    public_id = Column(String, primary_key=True)  # "<folder>/<md5 of processed bytes>"
+    secure_url = Column(String, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+
+# Storage deletions waiting to happen, drained in the background by app/tasks.py
+class AssetDeletion(Base):
+    __tablename__ = "asset_deletions"
+
+    id = Column(Integer, primary_key=True)
+    public_id = Column(String, unique=True, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, default=func.now(), index=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=func.now())
+
+
 # text_elements_json = Column(JSONB, nullable=False, default=list)
 # always search with email
 # comments = a later feature
@@ -0,0 +1,29 @@
+# app/pagination.py
+import base64
+import binascii
+import json
+from datetime import datetime
+from fastapi import HTTPException, status
+
+# Opaque keyset cursors: the sort key of the last row on a page, as
+# url-safe base64 json. Clients just echo back what they got in X-Next-Cursor.
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(key: tuple) -> str:
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in key]
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, types: tuple) -> tuple:
+    """Decode a cursor back into a key, `types` are the expected python types per column."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        return tuple(
+            datetime.fromisoformat(v) if t is datetime else t(v)
+            for t, v in zip(types, values, strict=True)
+        )
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
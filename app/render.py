@@ -0,0 +1,268 @@
+# app/render.py
+import hashlib
+import json
+import math
+import threading
+from functools import lru_cache
+from pathlib import Path
+from PIL import Image, ImageColor, ImageDraw, ImageFilter, ImageFont
+from core import metrics
+from core.cache import TTLCache
+from core.executors import BoundedExecutor
+from core.settings import settings
+from . import cloud, crud
+from .storage import get_storage
+
+# Server-side variant rendering: composites TextElements onto the template
+# image. Coordinates follow the editor canvas (Konva style): x/y is the top-left
+# of the text box, rotation is clockwise degrees around that point, and the
+# canvas is `canvas_width` px wide (defaults to the stored template image width).
+
+render_executor = BoundedExecutor("render", settings.render_workers, settings.render_queue_size)
+
+# decoded template bitmaps at render size, keyed by the template image public id
+_base_images = TTLCache(maxsize=settings.render_base_cache_size)
+
+# canonical variant key -> (thumbnail_url, thumbnail_public_id), backed by variants.render_hash
+_rendered = TTLCache(maxsize=settings.render_result_cache_size)
+render_cache_stats = {"hits": 0, "db_hits": 0, "misses": 0}
+
+_BOLD_WEIGHTS = {"bold", "bolder", "600", "700", "800", "900"}
+_COLOR_FIELDS = ("color", "outline_color", "shadow_color")
+
+
+@lru_cache(maxsize=1)
+def _font_files() -> dict[str, Path]:
+    """Fonts in settings.font_dir by lowercased file stem, e.g. "impact", "arial-bold"."""
+    font_dir = Path(settings.font_dir)
+    if not font_dir.is_dir():
+        return {}
+    return {p.stem.lower(): p for p in font_dir.iterdir() if p.suffix.lower() in (".ttf", ".otf")}
+
+
+def _font_path(family: str, bold: bool, italic: bool) -> Path | None:
+    files = _font_files()
+    name = family.strip().lower().replace(" ", "")
+    style = "bolditalic" if bold and italic else "bold" if bold else "italic" if italic else ""
+    candidates = [f"{name}-{style}", f"{name}{style}"] if style else []
+    for candidate in (*candidates, name):
+        if candidate in files:
+            return files[candidate]
+    return None
+
+
+@lru_cache(maxsize=512)
+def _load_font(family: str, size: int, bold: bool, italic: bool, thread_id: int):
+    # FreeType faces aren't safe to share between threads, so each worker gets its own
+    path = _font_path(family, bold, italic)
+    if path is None:
+        return ImageFont.load_default(size)
+    return ImageFont.truetype(str(path), size)
+
+
+def load_font(family: str, size: int, bold: bool = False, italic: bool = False):
+    return _load_font(family, size, bold, italic, threading.get_ident())
+
+
+@lru_cache(maxsize=4096)
+def layout_text(text: str, family: str, size: int, bold: bool, italic: bool, max_width: int):
+    """
+    Word-wrap `text` to max_width px. Returns (lines, line widths, line height).
+    Pure function of its args, so repeated captions skip the measuring entirely.
+    """
+    font = load_font(family, size, bold, italic)
+    lines = []
+    for paragraph in text.split("\n"):
+        line = ""
+        for word in paragraph.split(" "):
+            candidate = f"{line} {word}" if line else word
+            if line and font.getlength(candidate) > max_width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    ascent, descent = font.getmetrics()
+    return tuple(lines), tuple(font.getlength(line) for line in lines), ascent + descent
+
+
+def _color(value: str | None, default=(0, 0, 0, 255), opacity: float = 1.0):
+    try:
+        rgba = ImageColor.getcolor(value, "RGBA") if value else default
+    except ValueError:
+        rgba = default
+    return (*rgba[:3], round(rgba[3] * max(0.0, min(1.0, opacity))))
+
+
+def _draw_text(layer, el, lines, widths, line_height, font, fill, stroke, stroke_fill, pad):
+    draw = ImageDraw.Draw(layer)
+    box_width = layer.width - 2 * pad
+    align = el.text_align or "left"
+    for i, (line, width) in enumerate(zip(lines, widths)):
+        if align == "center":
+            x = pad + (box_width - width) / 2
+        elif align == "right":
+            x = pad + box_width - width
+        else:
+            x = pad
+        y = pad + i * line_height
+        draw.text((x, y), line, font=font, fill=fill, stroke_width=stroke, stroke_fill=stroke_fill)
+        thickness = max(1, font.size // 15)
+        if el.underline:
+            uy = y + font.getmetrics()[0] + thickness
+            draw.line([(x, uy), (x + width, uy)], fill=fill, width=thickness)
+        if el.linethrough:
+            ly = y + line_height / 2
+            draw.line([(x, ly), (x + width, ly)], fill=fill, width=thickness)
+
+
+def _render_element(canvas, el, scale: float):
+    size = max(1, round(el.font_size * scale))
+    bold = str(el.font_weight).lower() in _BOLD_WEIGHTS or "bold" in (el.font_style or "")
+    italic = "italic" in (el.font_style or "")
+    box_width = max(1, round((el.width or 0) * scale))
+    font = load_font(el.font_family, size, bold, italic)
+    lines, widths, line_height = layout_text(el.text, el.font_family, size, bold, italic, box_width)
+
+    stroke = max(0, round((el.outline_size or 0) * scale))
+    box_width = max(box_width, math.ceil(max(widths, default=0)))
+    shadow_reach = (el.shadow_blur or 0) + max(abs(el.shadow_offset_x or 0), abs(el.shadow_offset_y or 0))
+    pad = stroke + 2 + math.ceil(shadow_reach * scale)
+    layer = Image.new("RGBA", (box_width + 2 * pad, line_height * len(lines) + 2 * pad))
+
+    if el.shadow_offset_x or el.shadow_offset_y or el.shadow_blur:
+        shadow = Image.new("RGBA", layer.size)
+        shadow_fill = _color(el.shadow_color, opacity=el.shadow_opacity if el.shadow_opacity is not None else 1.0)
+        _draw_text(shadow, el, lines, widths, line_height, font, shadow_fill, stroke, shadow_fill, pad)
+        if el.shadow_blur:
+            shadow = shadow.filter(ImageFilter.GaussianBlur(el.shadow_blur * scale / 2))
+        offset = (round((el.shadow_offset_x or 0) * scale), round((el.shadow_offset_y or 0) * scale))
+        layer.alpha_composite(shadow.transform(layer.size, Image.AFFINE, (1, 0, -offset[0], 0, 1, -offset[1])))
+
+    _draw_text(layer, el, lines, widths, line_height, font, _color(el.color), stroke, _color(el.outline_color), pad)
+
+    # rotate around the box's top-left corner (x, y), like the editor does
+    theta = math.radians(el.rotation or 0)
+    half_w, half_h = layer.width / 2 - pad, layer.height / 2 - pad
+    cx = el.x * scale + half_w * math.cos(theta) - half_h * math.sin(theta)
+    cy = el.y * scale + half_w * math.sin(theta) + half_h * math.cos(theta)
+    if el.rotation:
+        layer = layer.rotate(-el.rotation, resample=Image.BICUBIC, expand=True)
+    canvas.alpha_composite(layer, (round(cx - layer.width / 2), round(cy - layer.height / 2)))
+
+
+def _render_sync(base, elements, scale: float, to_webp=True):
+    with metrics.image_stage_duration.time(stage="render"):
+        canvas = base.convert("RGBA")
+        for el in elements:
+            if el.text:
+                _render_element(canvas, el, scale)
+        canvas = canvas.convert("RGB")
+    return cloud._encode(canvas, to_webp)
+
+
+def _decode_base(data: bytes, max_size: int):
+    with cloud._open_image(data) as img:
+        full_width = img.width
+        return cloud._fit(img, max_size), full_width
+
+
+async def get_base_image(template, max_size: int = cloud.THUMBNAIL_SIZE):
+    """(bitmap fitted to max_size, width of the stored image) for a template, cached."""
+    key = (template.image_public_id, max_size)
+    cached = _base_images.get(key)
+    if cached is None:
+        # by the id the server stored, never a url (anything a client sent must not be fetched)
+        data = await get_storage().fetch(cloud.stored_url(template.image_public_id))
+        cached = await render_executor.run(_decode_base, data, max_size)
+        _base_images.set(key, cached)
+    return cached
+
+
+async def render_variant(template, elements, canvas_width: float | None = None, max_size: int = cloud.THUMBNAIL_SIZE):
+    """Render `elements` onto `template`'s image, returns (buffer, extension) like cloud.process_image."""
+    base, full_width = await get_base_image(template, max_size)
+    scale = base.width / (canvas_width or full_width)
+    return await render_executor.run(_render_sync, base, elements, scale)
+
+
+# --- Render result cache --- #
+def _canonical_color(value):
+    try:
+        rgba = ImageColor.getcolor(value, "RGBA")
+    except (ValueError, TypeError):
+        return value.strip().lower() if isinstance(value, str) else value
+    return "#" + "".join(f"{c:02x}" for c in (rgba if rgba[3] != 255 else rgba[:3]))
+
+
+def _canonical_value(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        # ints too: width=100 (the default) and width=100.0 (sent) are the same render
+        value = round(float(value), 2)
+        return 0.0 if value == 0 else value  # no -0.0
+    return value
+
+
+def variant_key(source_id: int, elements, canvas_width: float | None = None, max_size: int = cloud.THUMBNAIL_SIZE) -> str:
+    """
+    Hash of what a server render looks like: the template, the render scale
+    (canvas_width, output size) and the text elements with ids dropped, keys
+    sorted, numbers rounded and colors spelled one way, so "#FFF" at x=10.0001
+    and "#ffffff" at x=10 land on the same key. Only for render_variant output,
+    client uploads never get a key (anyone could upload anything for a caption).
+    """
+    canonical = []
+    for el in elements:
+        data = el.model_dump(exclude={"id"}) if hasattr(el, "model_dump") else {k: v for k, v in el.items() if k != "id"}
+        for field in _COLOR_FIELDS:
+            if data.get(field) is not None:
+                data[field] = _canonical_color(data[field])
+        if isinstance(data.get("font_family"), str):
+            data["font_family"] = data["font_family"].strip().lower()
+        canonical.append({k: _canonical_value(v) for k, v in data.items()})
+    scale = [_canonical_value(canvas_width), max_size]
+    payload = json.dumps([source_id, scale, canonical], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+async def find_rendered_many(db, keys) -> dict:
+    """
+    {key: (thumbnail_url, thumbnail_public_id)} for the keys an identical variant
+    already exists for, with a new asset reference taken per key (keys may repeat).
+    Memory first, then one query on variants.render_hash for the rest.
+    """
+    hits = {}
+    for key in set(keys):
+        hit = _rendered.get(key)
+        if hit is not None:
+            render_cache_stats["hits"] += 1
+            hits[key] = hit
+    missing = [key for key in set(keys) if key not in hits]
+    found = await crud.get_variant_thumbnails_by_hash(db, missing)
+    render_cache_stats["db_hits"] += len(found)
+    hits.update(found)
+
+    # the asset may have been released since, then it's a miss after all
+    acquired = await crud.acquire_assets(db, [hits[key][1] for key in keys if key in hits])
+    for key in list(hits):
+        if hits[key][1] not in acquired:
+            _rendered.pop(key)
+            del hits[key]
+        else:
+            _rendered.set(key, hits[key])
+    render_cache_stats["misses"] += len(set(keys) - hits.keys())
+    return hits
+
+
+async def find_rendered(db, key: str):
+    """(thumbnail_url, thumbnail_public_id) of an identical variant, with a new reference taken, or None."""
+    return (await find_rendered_many(db, [key])).get(key)
+
+
+def remember_rendered(key: str, thumb_url: str, thumb_id: str):
+    _rendered.set(key, (thumb_url, thumb_id))
+
+
+def cache_stats() -> dict:
+    # hits: served from memory, db_hits: found through variants.render_hash
+    return {**_rendered.stats(), **render_cache_stats}
@@ -1,49 +1,87 @@
 # app/routes.py
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
-from . import schemas, crud, database, cloud, models
-from core import auth
+from . import schemas, crud, database, cloud, models, http_cache, tasks, render, similar
+from .pagination import NEXT_CURSOR_HEADER, encode_cursor, decode_cursor
+from core import auth, metrics
+from core.settings import settings
 from datetime import datetime, timezone
-import json
-from pydantic import ValidationError
+from pydantic import ValidationError, TypeAdapter
 from fastapi import HTTPException, Form, status
-from typing import List, Optional
+from typing import List, Optional, Literal, Union
+from functools import lru_cache
+from pydantic import BaseModel
+from collections import Counter
 import asyncio
-from core.scripts.analysis import start_time, calculate_time
 import random
 import string
 
 router = APIRouter()
 
+# used by the cached read endpoints, which serialize once and store the bytes
+template_adapter = TypeAdapter(schemas.TemplateOut)
+template_create_adapter = TypeAdapter(schemas.TemplateCreateOut)
+variant_adapter = TypeAdapter(schemas.VariantOut)
+tags_adapter = TypeAdapter(List[schemas.TagOut])
+# text_elements form field, parsed and validated straight from the JSON string
+text_elements_adapter = TypeAdapter(List[schemas.TextElement])
+
+@lru_cache(maxsize=128)
+def list_adapter(model: type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(List[model])
+
+def dump_json(adapter: TypeAdapter, obj) -> bytes:
+    return adapter.dump_json(adapter.validate_python(obj, from_attributes=True))
+
+def json_response(adapter: TypeAdapter, obj, status_code: int = 200) -> Response:
+    # returning a Response skips FastAPI's own response_model pass, so this is the only one
+    return Response(content=dump_json(adapter, obj), media_type="application/json", status_code=status_code)
+
+def resolve_view(full: type[BaseModel], summary: type[BaseModel], view: str, fields: Optional[str]) -> type[BaseModel]:
+    """Pick the output schema for a list endpoint: ?fields=a,b wins over ?view=summary|full."""
+    if not fields:
+        return full if view == "full" else summary
+    wanted = frozenset(f.strip() for f in fields.split(",") if f.strip())
+    unknown = wanted - full.model_fields.keys()
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return schemas.projection(full, wanted)
+
 def generate_username(email: str, length: int = 4, email_length: int = 5) -> str:
     """Generate a username from email prefix + random digits."""
     base = email.split("@")[0][:email_length]
     random_suffix = ''.join(random.choices(string.ascii_lowercase+string.digits, k=length))
     return f"{base}{random_suffix}"
 
-async def generate_unique_username(db: Session, email: str, email_length: int = 5, length: int = 7) -> str:
-    """Generate a username and ensure it's unique in the database."""
-    while True:
-        username = generate_username(email, length, email_length)
-        existing = await crud.get_user_by_username(db, username)
-        if not existing:
-            return username
+def check_tags(tag: Optional[str]):
+    if len(crud.normalize_tags(tag)) > settings.tags_per_template_max:
+        raise HTTPException(status_code=400, detail=f"At most {settings.tags_per_template_max} tags per template")
 
 # --- User endpoints --- #
+USERNAME_CANDIDATES = 8  # per insert attempt, the DB keeps the first free one
+
 @router.post("/register", response_model=schemas.UserOut, status_code=status.HTTP_201_CREATED)
 async def register(user_in: schemas.UserCreate, db: Session = Depends(database.get_db)):
-    print(user_in.email)
-    existing = await crud.get_user_by_email(db, user_in.email)
-    if existing:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    if not user_in.username:
-        user_in.username = await generate_unique_username(db, user_in.email)
-    return await crud.create_user(db, user_in)
+    hashed_pw = await auth.hash_password_async(user_in.password)
+    for _ in range(3):
+        candidates = None if user_in.username else [
+            generate_username(user_in.email, length=7) for _ in range(USERNAME_CANDIDATES)
+        ]
+        user = await crud.create_user(db, user_in, hashed_password=hashed_pw, username_candidates=candidates)
+        if user:
+            return user
+        # nothing inserted: the email or username is taken, or every candidate lost a race
+        if await crud.get_user_by_email(db, user_in.email):
+            raise HTTPException(status_code=400, detail="Email already registered")
+        if user_in.username:
+            raise HTTPException(status_code=400, detail="Username already taken")
+    raise HTTPException(status_code=503, detail="Could not pick a username, try again", headers={"Retry-After": "1"})
 
 @router.post("/login")
 async def login(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
     db_user = await crud.get_user_by_email(db, user.email)
-    if not db_user or not auth.verify_password(user.password, db_user.hashed_password):
+    if not db_user or not await auth.verify_password_async(user.password, db_user.hashed_password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     token = auth.create_access_token({"sub": user.email})
     return {"access_token": token, "token_type": "bearer"}
@@ -54,11 +92,8 @@ async def read_users_me(current_user: models.User = Depends(auth.get_current_act
 
 def parse_text_elements(text_elements: str = Form(...)) -> List[schemas.TextElement]:
     try:
-        parsed = json.loads(text_elements)
-        for i in parsed:
-            i["id"] = float(i["id"])
-        return [schemas.TextElement(**t) for t in parsed]
-    except (ValueError, ValidationError) as e:
+        return text_elements_adapter.validate_json(text_elements)
+    except ValidationError as e:
         raise HTTPException(status_code=400, detail=f"Invalid text_elements JSON: {e}")
 
 # --- Template endpoints --- #
@@ -69,33 +104,106 @@ async def create_template(
     tag: Optional[str] = Form(None),
     text_elements: List[schemas.TextElement] = Depends(parse_text_elements),
     file: UploadFile = File(...),
-    file2: UploadFile = File(...),  # second file
+    file2: Optional[UploadFile] = File(None),  # optional thumbnail, derived from `file` when missing
     current_user = Depends(auth.get_current_active_user),
     db: Session = Depends(database.get_db),
 ):
+    check_tags(tag)  # before uploading anything
     upload_task = asyncio.create_task(cloud.upload_images(file, file2))
     tmpl_in = schemas.TemplateCreate(name=name, description=description, text_elements=text_elements, tag=tag)
     try:
-        image_url, public_id, thumb_url, thumb_id  = await upload_task
+        image_url, public_id, thumb_url, thumb_id, renditions, rendition_ids, phash = await upload_task
     except HTTPException as e: raise e 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Image upload failed: {e}")
     try:
-        return await crud.create_template(db, tmpl_in, owner_id=current_user.id, image_url=image_url, 
-                thumbnail_url=thumb_url, image_public_id=public_id, thumbnail_public_id=thumb_id)
+        result = await crud.create_template(db, tmpl_in, owner_id=current_user.id, image_url=image_url, 
+                thumbnail_url=thumb_url, image_public_id=public_id, thumbnail_public_id=thumb_id,
+                renditions=renditions, rendition_public_ids=rendition_ids, phash=phash)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
+    await http_cache.invalidate("templates", "tags")
+
+    # created anyway, the client decides what to do about the warning
+    near = similar.index.near(phash, settings.similar_duplicate_distance, limit=5, exclude=result["id"])
+    similar.index.add(result["id"], phash)
+    if near:
+        result["near_duplicates"] = await similar_summaries(db, near)
+    return json_response(template_create_adapter, result, status.HTTP_201_CREATED)
 
-@router.get("/templates", response_model=List[schemas.TemplateOut])
-async def list_templates(search: Optional[str] = None, skip: int = 0, limit: int = 10, db: Session = Depends(database.get_db)):
-    return await crud.list_templates(db, skip=skip, limit=limit, search=search)
+async def similar_summaries(db, matches: list[tuple[int, int]]) -> list[dict]:
+    """
+    SimilarTemplate dicts for index matches, in match order. Ids deleted meanwhile
+    (through another worker) leave the index, once the primary confirms they're
+    gone: `db` may be a lagging replica that doesn't have a fresh template yet.
+    """
+    fields = list(schemas.TemplateSummary.model_fields)
+    items = await crud.get_templates_by_ids(db, [template_id for template_id, _ in matches], columns=fields)
+    distances = dict(matches)
+    missing = distances.keys() - {t.id for t in items}
+    if missing:
+        async with database.AsyncSessionLocal() as primary:
+            present = await crud.get_templates_by_ids(primary, list(missing), columns=["id"])
+        for template_id in missing - {t.id for t in present}:
+            similar.index.remove(template_id)
+    return [{**{f: getattr(t, f) for f in fields}, "distance": distances[t.id]} for t in items]
+
+# Read endpoints are served from app/http_cache.py (ETag + If-None-Match -> 304).
+# Variant writes don't drop "templates", so trending/popular order can lag by response_cache_ttl.
+CURSOR_TYPES = {"recent": datetime, "trending": float, "popular": int}
+
+@router.get("/templates", response_model=List[Union[schemas.TemplateSummary, schemas.TemplateOut]])
+async def list_templates(
+    request: Request,
+    search: Optional[str] = None,
+    ids: Optional[str] = None,  # ?ids=1,2,3 resolves those templates in order, no paging
+    sort: Literal["recent", "trending", "popular"] = "recent",  # ignored with ?search= (relevance)
+    tags: Optional[str] = None,  # ?tags=cats,reaction
+    tag_mode: Literal["all", "any"] = "all",
+    cursor: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 10,
+    view: Literal["summary", "full"] = "summary",
+    fields: Optional[str] = None,
+    db: Session = Depends(database.get_read_db),
+):
+    cached = http_cache.lookup(request)
+    if cached.response:
+        return cached.response
+
+    out = resolve_view(schemas.TemplateOut, schemas.TemplateSummary, view, fields)
+    if ids is not None:
+        try:
+            wanted = [int(i) for i in ids.split(",") if i.strip()]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="ids must be comma separated integers")
+        if len(wanted) > settings.template_ids_max:
+            raise HTTPException(status_code=400, detail=f"At most {settings.template_ids_max} ids per request")
+        items = await crud.get_templates_by_ids(db, wanted, columns=list(out.model_fields))
+        return cached.store(dump_json(list_adapter(out), items), ["templates"])
+
+    # next page (if any) is returned in the X-Next-Cursor header, pass it back as ?cursor=
+    after = decode_cursor(cursor, (CURSOR_TYPES[sort], int)) if cursor else None
+    wanted_tags = crud.normalize_tags(tags)
+    if len(wanted_tags) > settings.tags_filter_max:
+        raise HTTPException(status_code=400, detail=f"At most {settings.tags_filter_max} tags per request")
+    items, next_key = await crud.list_templates(
+        db, skip=skip, limit=limit, search=search, tags=wanted_tags, tag_mode=tag_mode, after=after,
+        columns=list(out.model_fields), sort=sort,
+    )
+    headers = {NEXT_CURSOR_HEADER: encode_cursor(next_key)} if next_key else None
+    return cached.store(dump_json(list_adapter(out), items), ["templates"], headers)
 
 @router.get("/templates/{template_id}", response_model=schemas.TemplateOut)
-def get_template(template_id: int, db: Session = Depends(database.get_db)):
-    tmpl = crud.get_template(db, template_id)
+async def get_template(template_id: int, request: Request, db: Session = Depends(database.get_read_db)):
+    cached = http_cache.lookup(request)
+    if cached.response:
+        return cached.response
+
+    tmpl = await crud.get_template(db, template_id)
     if not tmpl:
         raise HTTPException(status_code=404, detail="Template not found")
-    return tmpl
+    return cached.store(dump_json(template_adapter, tmpl), [f"template:{template_id}"])
 
 # @router.put("/templates/{template_id}",  status_code=status.HTTP_206_PARTIAL_CONTENT)#response_model=schemas.TemplateOut)
 # async def update_template(
@@ -145,11 +253,16 @@ async def update_template(
     tag: Optional[str] = Form(None),
     text_elements: Optional[List[schemas.TextElement]] = Depends(parse_text_elements),
     file2: Optional[UploadFile] = File(None),
-    thumbnail_url: str = Form(None),
-    image_url: str = Form(None),
     current_user=Depends(auth.get_current_active_user),
     db: Session = Depends(database.get_db),
 ):
+    check_tags(tag)
+    template: models.Template = await crud.get_template(db, template_id)
+    if not template:
+        raise HTTPException(status_code=404, detail="Template not found")
+    if template.owner_id != current_user.id and not current_user.is_superuser:
+        raise HTTPException(status_code=403, detail="Not your template")
+
     # Initialize update_data with the basic fields
     update_data = schemas.TemplateCreate(
         name=name, 
@@ -158,30 +271,28 @@ async def update_template(
         tag=tag
     ).model_dump()
     
-    # If new thumbnail uploaded → update only thumbnail, keep original image
+    # If new thumbnail uploaded → update only thumbnail, keep original image.
+    # Urls and ids come from the row, never from the request (the renderer fetches the image)
     if file2:
-        image_public_id = cloud.get_public_id(image_url)
-        thumbnail_public_id = cloud.get_public_id(thumbnail_url)
-        
         try:
             upload_task = asyncio.create_task(
-                cloud.update_images(image_url, image_public_id, thumbnail_public_id, file2)
+                cloud.update_images(template.image_public_id, template.thumbnail_public_id, file2)
             )
-            _, _, thumb_url, thumb_id = await upload_task
+            image_url, _, thumb_url, thumb_id = await upload_task
             
-            # Update with new thumbnail but keep original image
             update_data.update({
-                "image_url": image_url,  # unchanged
+                "image_url": image_url,  # rebuilt from the unchanged image id
                 "thumbnail_url": thumb_url,  # new
-                "image_public_id": image_public_id,  # unchanged
                 "thumbnail_public_id": thumb_id,  # new
             })
+        except HTTPException as e: raise e
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Image upload failed: {e}")
 
     result = await crud.update_template(db, template_id, update_data, current_user)
     if not result:
         raise HTTPException(status_code=404, detail="Template not found or not permitted")
+    await http_cache.invalidate("templates", f"template:{template_id}", "tags")
     
     return {"message": "Template updated successfully"}
 
@@ -196,53 +307,263 @@ async def delete_template(
     if not template:
         raise HTTPException(status_code=404, detail="Template not found")
 
-    # delete DB entry
-    result = await crud.delete_template(db, template_id, current_user)
-    if result.rowcount == 0:
+    # delete DB entry, its images and its variants' thumbnails get queued for deletion
+    deleted = await crud.delete_template(db, template_id, current_user)
+    if not deleted:
         raise HTTPException(status_code=404, detail="Template not found or not permitted")
-
-    # delete images (non-blocking)
-    await cloud.delete_images(template.image_public_id, template.thumbnail_public_id)
+    await http_cache.invalidate("templates", f"template:{template_id}", f"variants:{template_id}", "tags")
+    similar.index.remove(template_id)
+    tasks.wake_asset_deletions()
 
     return
 
+@router.get("/templates/{template_id}/similar", response_model=List[schemas.SimilarTemplate])
+async def similar_templates(
+    template_id: int,
+    request: Request,
+    max_distance: int = 10,
+    limit: int = 20,
+    db: Session = Depends(database.get_read_db),
+):
+    """Templates whose image looks like this one's, closest first (in-memory index, app/similar.py)."""
+    cached = http_cache.lookup(request)
+    if cached.response:
+        return cached.response
+
+    value = similar.index.hashes.get(template_id)
+    if value is None:
+        tmpl = await crud.get_template(db, template_id)
+        if not tmpl:
+            raise HTTPException(status_code=404, detail="Template not found")
+        if tmpl.phash is None:  # uploaded before hashing and not backfilled yet
+            return cached.store(b"[]", ["templates", f"template:{template_id}"])
+        value = similar.from_db(tmpl.phash)
+
+    max_distance = max(0, min(max_distance, settings.similar_max_distance))
+    matches = similar.index.near(value, max_distance, limit=max(1, min(limit, 100)), exclude=template_id)
+    items = await similar_summaries(db, matches) if matches else []
+    return cached.store(
+        dump_json(list_adapter(schemas.SimilarTemplate), items), ["templates", f"template:{template_id}"]
+    )
+
+# Tag facets for the gallery filter, counts are maintained on template writes
+@router.get("/tags", response_model=List[schemas.TagOut])
+async def list_tags(
+    request: Request,
+    prefix: Optional[str] = None,  # autocomplete
+    limit: int = 50,
+    db: Session = Depends(database.get_read_db),
+):
+    cached = http_cache.lookup(request)
+    if cached.response:
+        return cached.response
+
+    limit = max(1, min(limit, settings.tags_list_max))
+    prefix = next(iter(crud.normalize_tags([prefix or ""])), None)
+    rows = await crud.list_tags(db, limit=limit, prefix=prefix)
+    return cached.store(dump_json(tags_adapter, rows), ["tags"])
+
 
 # --- Variants --- #
+async def render_and_store(template: models.Template, text_elements: List[schemas.TextElement], canvas_width: Optional[float]):
+    buffer, extension = await render.render_variant(template, text_elements, canvas_width)
+    return await cloud.store_image(buffer, extension, folder=cloud.THUMBNAIL)
+
 @router.post("/variants", response_model=schemas.VariantOut, status_code=status.HTTP_201_CREATED) # ✅
 async def create_variant(
-    file: UploadFile = File(...),
+    file: Optional[UploadFile] = File(None),  # rendered on the server when missing
     source_id: int = Form(...),
     text_elements: List[schemas.TextElement] = Depends(parse_text_elements),
+    canvas_width: Optional[float] = Form(None, gt=0),  # editor canvas width the x/y/sizes refer to
     current_user = Depends(auth.get_current_active_user), 
     db: Session = Depends(database.get_db)
 ):
-    st = start_time()
-    upload_task = asyncio.create_task(cloud.upload_image(file, cloud.THUMBNAIL, cloud.THUMBNAIL_SIZE))
     variant_in = schemas.VariantCreate(text_elements=text_elements, source_id=source_id)
+    # the same captions on the same template were rendered before, reuse that thumbnail
+    # (server renders only, byte identical uploads are already shared by the asset index)
+    render_hash = render.variant_key(source_id, text_elements, canvas_width) if file is None else None
+    cached = await render.find_rendered(db, render_hash) if render_hash else None
+    if cached:
+        thumb_url, thumb_id = cached
+    else:
+        if file is not None:
+            upload_task = asyncio.create_task(cloud.upload_image(file, cloud.THUMBNAIL, cloud.THUMBNAIL_SIZE))
+        else:
+            template = await crud.get_template(db, source_id)
+            if not template:
+                raise HTTPException(status_code=404, detail="Template not found")
+            upload_task = asyncio.create_task(render_and_store(template, text_elements, canvas_width))
 
+        try:
+            thumb_url, thumb_id = await upload_task
+            
+        except HTTPException as e: raise e 
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Image upload failed: {e}")
     try:
-        thumb_url, thumb_id = await upload_task
-        
-    except HTTPException as e: raise e 
+        result = await crud.create_variant(db, thumb_url, thumb_id,
+            owner_id=current_user.id, variant_in=variant_in, render_hash=render_hash)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Image upload failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+    if render_hash:
+        render.remember_rendered(render_hash, thumb_url, thumb_id)
+    await http_cache.invalidate(f"variants:{source_id}", f"template:{source_id}")
+    return json_response(variant_adapter, result, status.HTTP_201_CREATED)
+
+variant_batch_adapter = TypeAdapter(List[schemas.VariantBatchItem])
+
+@router.post("/variants:batch", response_model=List[schemas.VariantOut], status_code=status.HTTP_201_CREATED)
+async def create_variants(
+    variants: str = Form(...),  # JSON list of VariantBatchItem
+    files: Optional[List[UploadFile]] = File(None),
+    current_user = Depends(auth.get_current_active_user),
+    db: Session = Depends(database.get_db),
+):
+    """
+    Create several variants in one request: thumbnails are uploaded/rendered
+    concurrently and the rows go in with a single INSERT. All or nothing.
+    """
     try:
-        result = await crud.create_variant(db, thumb_url, thumb_id,
-            owner_id=current_user.id, variant_in=variant_in)
-        print(calculate_time(st))
-        return result
+        items = variant_batch_adapter.validate_json(variants)
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid variants JSON: {e}")
+    files = files or []
+    if not items or len(items) > settings.variant_batch_max_size:
+        raise HTTPException(status_code=400, detail=f"A batch takes 1 to {settings.variant_batch_max_size} variants")
+    if any(item.file_index is not None and item.file_index >= len(files) for item in items):
+        raise HTTPException(status_code=400, detail="file_index out of range")
+
+    source_ids = list(dict.fromkeys(item.source_id for item in items))
+    templates = {t.id: t for t in await crud.get_templates_by_ids(db, source_ids)}
+    missing = [i for i in source_ids if i not in templates]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Templates not found: {', '.join(map(str, missing))}")
+
+    # render keys for the server rendered items only, uploads are never reused by caption
+    keys = [
+        render.variant_key(item.source_id, item.text_elements, item.canvas_width) if item.file_index is None else None
+        for item in items
+    ]
+    cached = await render.find_rendered_many(db, [key for key in keys if key])
+    sem = asyncio.Semaphore(settings.variant_batch_concurrency)
+
+    async def upload(file_index):
+        async with sem:
+            return await cloud.upload_image(files[file_index], cloud.THUMBNAIL, cloud.THUMBNAIL_SIZE)
+
+    async def thumbnail(item, key):
+        if key and key in cached:
+            return cached[key]
+        async with sem:
+            return await render_and_store(templates[item.source_id], item.text_elements, item.canvas_width)
+
+    # each file is read and uploaded once however many items point at it (reading one
+    # spooled UploadFile from two threads interleaves the seeks), items share the result
+    uploads = {
+        i: asyncio.ensure_future(upload(i))
+        for i in dict.fromkeys(item.file_index for item in items if item.file_index is not None)
+    }
+    jobs = [uploads[item.file_index] if item.file_index is not None else thumbnail(item, key)
+            for item, key in zip(items, keys)]
+    thumbs = await asyncio.gather(*jobs, return_exceptions=True)
+    # an upload took one reference, every item pointing at it needs its own
+    counts = Counter(item.file_index for item in items if item.file_index is not None)
+    extra = [task.result()[1] for i, task in uploads.items() if not task.exception() for _ in range(counts[i] - 1)]
+    if extra:
+        async with database.AsyncSessionLocal() as refs_db:
+            await crud.acquire_assets(refs_db, extra)
+    # every stored/reused thumbnail holds a reference, give them back if the batch fails
+    held = [t[1] for t in thumbs if not isinstance(t, BaseException)]
+    errors = [t for t in thumbs if isinstance(t, BaseException)]
+    if errors:
+        await cloud.delete_images(*held)
+        if isinstance(errors[0], HTTPException):
+            raise errors[0]
+        raise HTTPException(status_code=500, detail=f"Image upload failed: {errors[0]}")
+
+    rows = [
+        {"thumb_url": url, "thumb_id": public_id, "render_hash": key,
+         "variant_in": schemas.VariantCreate(source_id=item.source_id, text_elements=item.text_elements)}
+        for item, key, (url, public_id) in zip(items, keys, thumbs)
+    ]
+    try:
+        result = await crud.create_variants(db, current_user.id, rows)
     except Exception as e:
+        await cloud.delete_images(*held)
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
 
-@router.get("/templates/{template_id}/variants", response_model=List[schemas.VariantOut])
-async def list_variants(template_id: int, skip: int = 0, limit: int = 10, db: Session = Depends(database.get_db)):
-    return await crud.list_variants_for_template(db, template_id, skip=skip, limit=limit)
+    for key, (url, public_id) in zip(keys, thumbs):
+        if key:
+            render.remember_rendered(key, url, public_id)
+    await http_cache.invalidate(*(f"variants:{sid}" for sid in source_ids), *(f"template:{sid}" for sid in source_ids))
+    return json_response(list_adapter(schemas.VariantOut), result, status.HTTP_201_CREATED)
+
+@router.delete("/variants/{variant_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_variant(
+    variant_id: int,
+    current_user = Depends(auth.get_current_active_user),
+    db: Session = Depends(database.get_db),
+):
+    variant = await crud.get_variant(db, variant_id)
+    if not variant:
+        raise HTTPException(status_code=404, detail="Variant not found")
+    if variant.owner_id != current_user.id and not current_user.is_superuser:
+        raise HTTPException(status_code=403, detail="Not your variant")
+
+    if not await crud.delete_variant(db, variant_id):
+        raise HTTPException(status_code=404, detail="Variant not found")
+    await http_cache.invalidate(f"variants:{variant.source_id}", f"template:{variant.source_id}")
+    tasks.wake_asset_deletions()
+
+@router.get("/templates/{template_id}/variants", response_model=List[Union[schemas.VariantSummary, schemas.VariantOut]])
+async def list_variants(
+    template_id: int,
+    request: Request,
+    cursor: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 10,
+    view: Literal["summary", "full"] = "summary",
+    fields: Optional[str] = None,
+    db: Session = Depends(database.get_read_db),
+):
+    cached = http_cache.lookup(request)
+    if cached.response:
+        return cached.response
+
+    out = resolve_view(schemas.VariantOut, schemas.VariantSummary, view, fields)
+    after = decode_cursor(cursor, (int,))[0] if cursor else None
+    items, next_key = await crud.list_variants_for_template(
+        db, template_id, skip=skip, limit=limit, after=after, columns=list(out.model_fields)
+    )
+    headers = {NEXT_CURSOR_HEADER: encode_cursor(next_key)} if next_key else None
+    return cached.store(dump_json(list_adapter(out), items), [f"variants:{template_id}"], headers)
 
 # Health check
 @router.get("/health") # ✅
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.now(timezone.utc)}
 
+@router.get("/ready")
+async def readiness(request: Request):
+    """For the load balancer: 200 once migrations ran and the pool is warm, 503 until then."""
+    if not getattr(request.app.state, "ready", False):
+        detail = getattr(request.app.state, "startup_error", None) or "starting"
+        return JSONResponse({"status": detail}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return {"status": "ready"}
+
+@router.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@router.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters of the in-process caches."""
+    return {
+        "render": render.cache_stats(),
+        "responses": http_cache.stats(),
+        "principals": auth.cache_stats(),
+    }
+
 @router.get("/alive-api")
 async def check_alive():
     """
@@ -1,6 +1,7 @@
-from pydantic import BaseModel, EmailStr, Field, ConfigDict
-from typing import List, Optional, Union
+from pydantic import BaseModel, EmailStr, Field, ConfigDict, create_model
+from typing import Dict, List, Optional, Union
 from datetime import datetime
+from functools import lru_cache
 # from pydantic_extra_types.color import Color
 
 # c = Color('ff00ff')
@@ -11,7 +12,7 @@ from datetime import datetime
 
 # Text element schema (not a DB model)
 class TextElement(BaseModel):
-    id: Optional[float] = None # unnessesary since its no being auto gen
+    id: Optional[float] = None # unnessesary since its no being auto gen, editor ids arrive as numbers or numeric strings and are coerced
     text: str
     x: float
     y: float
@@ -88,6 +89,10 @@ class TemplateBase(BaseModel):
 class TemplateCreate(TemplateBase):
     pass
 
+# {"webp": {256: url, 512: url, ...}, "avif": {...}}, image width -> url, build
+# srcset from it and let the browser pick. None for templates uploaded before renditions
+Renditions = Dict[str, Dict[int, str]]
+
 class TemplateOut(TemplateBase): # might be toomuch info because we have most of the info already in the frontend the only info we don't have is the image url
     id: int
     image_url: str
@@ -95,15 +100,34 @@ class TemplateOut(TemplateBase): # might be toomuch info because we have most of
     owner_id: int
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
+    variant_count: int = 0
+    renditions: Optional[Renditions] = None
 
     model_config = ConfigDict(from_attributes=True)
 
+# what the gallery grid needs, the default for list endpoints (?view=full for TemplateOut)
+class TemplateSummary(BaseModel):
+    id: int
+    name: str
+    tag: Optional[str] = None
+    thumbnail_url: str
+    renditions: Optional[Renditions] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+# GET /templates/{id}/similar and the POST /templates duplicate warning,
+# distance is in differing bits of the 64-bit image hash (0 = same picture)
+class SimilarTemplate(TemplateSummary):
+    distance: int
+
 class TemplateCreateOut(TemplateBase):
     id: int
     image_url: str
     thumbnail_url: str
     owner_id: int
+    renditions: Optional[Renditions] = None
     created_at: Optional[datetime] = None
+    near_duplicates: List[SimilarTemplate] = []
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -116,6 +140,13 @@ class Template(TemplateBase):
     class Config:
         from_attributes = True
 
+# GET /tags
+class TagOut(BaseModel):
+    name: str
+    template_count: int
+
+    model_config = ConfigDict(from_attributes=True)
+
 # --- Variant --- #
 class VariantBase(BaseModel):
     text_elements: List[TextElement]
@@ -123,6 +154,12 @@ class VariantBase(BaseModel):
 class VariantCreate(VariantBase):
     source_id: int  # which template this variant is derived from
 
+# one entry of POST /variants:batch, `file_index` points into the uploaded files
+# (rendered on the server when missing, like POST /variants without a file)
+class VariantBatchItem(VariantCreate):
+    canvas_width: Optional[float] = Field(default=None, gt=0)
+    file_index: Optional[int] = Field(default=None, ge=0)
+
 class VariantOut(VariantBase):
     id: int
     owner_id: int
@@ -131,6 +168,23 @@ class VariantOut(VariantBase):
 
     model_config = ConfigDict(from_attributes=True)
 
+class VariantSummary(BaseModel):
+    id: int
+    source_id: int
+    thumbnail_url: str
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+@lru_cache(maxsize=64)
+def projection(model: type[BaseModel], fields: frozenset[str]) -> type[BaseModel]:
+    """Subset of `model` with only `fields` (for ?fields=), built once per field set."""
+    return create_model(
+        f"{model.__name__}Fields",
+        __config__=ConfigDict(from_attributes=True),
+        **{name: (info.annotation, info) for name, info in model.model_fields.items() if name in fields},
+    )
+
 
 
 # class TemplateBase(BaseModel):
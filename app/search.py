@@ -0,0 +1,42 @@
+# app/search.py
+import re
+from sqlalchemy import func
+from . import models
+
+SEARCH_CONFIG = "simple"  # no stemming, meme names are slang and multi-language
+MAX_TERMS = 8
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def to_prefix_tsquery(q: str) -> str | None:
+    """
+    Turn free text into a prefix tsquery, "dist boyf" -> "dist:* & boyf:*".
+    Only word characters survive so user input can't inject tsquery syntax.
+    """
+    terms = _TERM_RE.findall(q.lower())[:MAX_TERMS]
+    if not terms:
+        return None
+    return " & ".join(f"{t}:*" for t in terms)
+
+
+def apply_search(stmt, q: str):
+    """
+    Filter and rank a Template select by `q`.
+    Full-text prefix match on name/description (GIN on search_vector) with a
+    trigram fallback on name for typos (GIN on name gin_trgm_ops).
+    """
+    q = q.strip()
+    similarity = func.similarity(models.Template.name, q)
+    fuzzy = models.Template.name.op("%")(q)
+
+    tsquery_text = to_prefix_tsquery(q)
+    if tsquery_text is None:
+        return stmt.where(fuzzy).order_by(similarity.desc(), models.Template.id.desc())
+
+    tsquery = func.to_tsquery(SEARCH_CONFIG, tsquery_text)
+    rank = func.ts_rank_cd(models.Template.search_vector, tsquery)
+    return stmt.where(models.Template.search_vector.op("@@")(tsquery) | fuzzy).order_by(
+        (rank + similarity).desc(),
+        models.Template.created_at.desc(),
+        models.Template.id.desc(),
+    )
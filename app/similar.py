@@ -0,0 +1,109 @@
+# app/similar.py
+from itertools import combinations
+from PIL import Image
+
+# Near-duplicate detection on a 64-bit dHash of each template image: rescaled or
+# re-encoded copies of a meme land a few bits apart, different images ~32 apart.
+# Lookups go through a multi-index hash table: the hash is cut into 4 chunks of
+# 16 bits, and two hashes within distance d must agree on at least one chunk to
+# within d // 4 bits (pigeonhole). So a query probes a handful of buckets per
+# chunk and only compares the few candidates in them, never the whole catalogue.
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+_CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+def dhash(img) -> int:
+    """64-bit difference hash: each bit says whether a pixel is brighter than its right neighbour (9x8 grayscale)."""
+    small = img.convert("L").resize((9, 8), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left, right = pixels[row * 9 + col], pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+# postgres bigint is signed, hashes are unsigned
+def to_db(value: int) -> int:
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def from_db(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+def distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _chunks(value: int):
+    return [(value >> (i * CHUNK_BITS)) & _CHUNK_MASK for i in range(CHUNKS)]
+
+
+def _neighbours(chunk: int, radius: int):
+    """Every 16-bit value within `radius` bits of chunk (1 + 16 + 120 values for radius 2)."""
+    yield chunk
+    for r in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), r):
+            flip = 0
+            for b in bits:
+                flip |= 1 << b
+            yield chunk ^ flip
+
+
+class PhashIndex:
+    """
+    id -> hash plus, per chunk, chunk value -> ids. Mutated from the event loop
+    only (create/delete routes and the refresh task), so no locking.
+    """
+
+    def __init__(self):
+        self.hashes: dict[int, int] = {}
+        self.tables: list[dict[int, list[int]]] = [{} for _ in range(CHUNKS)]
+        self.max_id = 0  # highest id seen, the refresh task loads newer rows
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def add(self, template_id: int, value: int):
+        if template_id in self.hashes:
+            self.remove(template_id)
+        self.hashes[template_id] = value
+        for table, chunk in zip(self.tables, _chunks(value)):
+            table.setdefault(chunk, []).append(template_id)
+        self.max_id = max(self.max_id, template_id)
+
+    def remove(self, template_id: int):
+        value = self.hashes.pop(template_id, None)
+        if value is None:
+            return
+        for table, chunk in zip(self.tables, _chunks(value)):
+            bucket = table.get(chunk)
+            if bucket is not None:
+                bucket.remove(template_id)
+                if not bucket:
+                    del table[chunk]
+
+    def near(self, value: int, max_distance: int, limit: int = 20, exclude: int | None = None) -> list[tuple[int, int]]:
+        """[(template_id, distance)] within max_distance of `value`, closest first (ties newest first)."""
+        radius = max_distance // CHUNKS
+        seen = set() if exclude is None else {exclude}
+        found = []
+        for table, chunk in zip(self.tables, _chunks(value)):
+            for probe in _neighbours(chunk, radius):
+                for template_id in table.get(probe, ()):
+                    if template_id in seen:
+                        continue
+                    seen.add(template_id)
+                    d = distance(value, self.hashes[template_id])
+                    if d <= max_distance:
+                        found.append((template_id, d))
+        found.sort(key=lambda item: (item[1], -item[0]))
+        return found[:limit]
+
+
+index = PhashIndex()
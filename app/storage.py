@@ -0,0 +1,236 @@
+# app/storage.py
+import asyncio
+import hashlib
+import re
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+import httpx
+from core.executors import io_executor
+from core.settings import settings
+
+
+class StorageError(Exception):
+    pass
+
+
+class StorageBackend(ABC):
+    """
+    Where processed images end up. Public ids look like "<folder>/<name>",
+    the extension is kept separate so urls can be rebuilt from an id.
+    """
+
+    @abstractmethod
+    async def upload(self, data: bytes, folder: str, name: str, extension: str) -> tuple[str, str]:
+        """Store `data` as <folder>/<name>, returns (url, public_id). Existing ids are kept, not overwritten."""
+
+    @abstractmethod
+    async def destroy(self, public_id: str) -> None:
+        ...
+
+    async def destroy_many(self, public_ids: list[str]) -> None:
+        await asyncio.gather(*(self.destroy(pid) for pid in public_ids))
+
+    @abstractmethod
+    async def fetch(self, url: str) -> bytes:
+        """Bytes of a stored image, by the url `upload` returned."""
+
+    @abstractmethod
+    def url(self, public_id: str, extension: str) -> str:
+        ...
+
+    @abstractmethod
+    def public_id_from_url(self, url: str) -> str | None:
+        ...
+
+    async def aclose(self) -> None:
+        pass
+
+
+class CloudinaryBackend(StorageBackend):
+    """
+    Cloudinary over its REST API with one pooled keep-alive client,
+    instead of the blocking SDK burning an executor thread per call.
+    """
+    API_URL = "https://api.cloudinary.com/v1_1"
+    DELIVERY_URL = "https://res.cloudinary.com"
+    BULK_DELETE_LIMIT = 100  # admin api max public_ids per call
+    _URL_RE = re.compile(r"/upload/(?:v\d+/)?(.+)\.\w+$")
+
+    def __init__(self, cloud_name: str, api_key: str, api_secret: str, max_connections: int = 20):
+        if not (cloud_name and api_key and api_secret):
+            raise StorageError("Cloudinary backend needs cloud_name, cloud_api_key and cloud_api_secret")
+        self.cloud_name = cloud_name
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.client = httpx.AsyncClient(
+            base_url=f"{self.API_URL}/{cloud_name}",
+            timeout=httpx.Timeout(30.0, connect=5.0),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    def _signed(self, params: dict) -> dict:
+        # https://cloudinary.com/documentation/authentication_signatures
+        params = {k: v for k, v in params.items() if v is not None}
+        params["timestamp"] = str(int(time.time()))
+        to_sign = "&".join(f"{k}={params[k]}" for k in sorted(params))
+        params["signature"] = hashlib.sha1((to_sign + self.api_secret).encode()).hexdigest()
+        params["api_key"] = self.api_key
+        return params
+
+    async def _call(self, method: str, path: str, **kwargs) -> dict:
+        try:
+            res = await self.client.request(method, path, **kwargs)
+        except httpx.HTTPError as e:
+            raise StorageError(f"Cloudinary request failed: {e}") from e
+        body = res.json() if res.headers.get("content-type", "").startswith("application/json") else {}
+        if res.is_error:
+            message = body.get("error", {}).get("message", res.text)
+            raise StorageError(f"Cloudinary {path} returned {res.status_code}: {message}")
+        return body
+
+    async def upload(self, data, folder, name, extension):
+        params = self._signed({
+            "folder": folder,
+            "public_id": name,
+            "format": extension,
+            "overwrite": "false",
+            "unique_filename": "false",
+            "invalidate": "false",
+        })
+        body = await self._call("POST", "/image/upload", data=params, files={"file": (f"{name}.{extension}", data)})
+        return body["secure_url"], body["public_id"]
+
+    async def destroy(self, public_id):
+        await self._call("POST", "/image/destroy", data=self._signed({"public_id": public_id}))
+
+    async def destroy_many(self, public_ids):
+        for i in range(0, len(public_ids), self.BULK_DELETE_LIMIT):
+            chunk = public_ids[i:i + self.BULK_DELETE_LIMIT]
+            await self._call(
+                "DELETE", "/resources/image/upload",
+                params=[("public_ids[]", pid) for pid in chunk],
+                auth=(self.api_key, self.api_secret),
+            )
+
+    async def fetch(self, url):
+        # only our own delivery urls, this client carries no credentials but it must not reach anything else
+        if not url.startswith(f"{self.DELIVERY_URL}/{self.cloud_name}/"):
+            raise StorageError(f"Not a {self.cloud_name} delivery url: {url}")
+        try:
+            res = await self.client.get(url)
+            res.raise_for_status()
+        except httpx.HTTPError as e:
+            raise StorageError(f"Fetching {url} failed: {e}") from e
+        return res.content
+
+    def url(self, public_id, extension):
+        return f"{self.DELIVERY_URL}/{self.cloud_name}/image/upload/{public_id}.{extension}"
+
+    def public_id_from_url(self, url):
+        match = self._URL_RE.search(url)
+        return match.group(1) if match else None
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class LocalBackend(StorageBackend):
+    """Files on disk under `root`, served by the app at `base_url` (see main.py)."""
+
+    def __init__(self, root: str, base_url: str):
+        self.root = Path(root)
+        self.base_url = base_url.rstrip("/")
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _write(self, path: Path, data: bytes):
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)
+
+    def _remove(self, public_id: str):
+        for path in self.root.glob(f"{public_id}.*"):
+            path.unlink(missing_ok=True)
+
+    async def upload(self, data, folder, name, extension):
+        public_id = f"{folder}/{name}"
+        await io_executor.run(self._write, self.root / f"{public_id}.{extension}", data)
+        return self.url(public_id, extension), public_id
+
+    async def destroy(self, public_id):
+        await io_executor.run(self._remove, public_id)
+
+    async def fetch(self, url):
+        public_id = self.public_id_from_url(url)
+        paths = list(self.root.glob(f"{public_id}.*")) if public_id and ".." not in public_id.split("/") else []
+        if not paths:
+            raise StorageError(f"No local file for {url}")
+        return await io_executor.run(paths[0].read_bytes)
+
+    def url(self, public_id, extension):
+        return f"{self.base_url}/{public_id}.{extension}"
+
+    def public_id_from_url(self, url):
+        if not url.startswith(self.base_url + "/"):
+            return None
+        return url[len(self.base_url) + 1:].rsplit(".", 1)[0]
+
+
+class MemoryBackend(StorageBackend):
+    """Keeps everything in a dict, for benchmarks and running fully offline."""
+
+    def __init__(self):
+        self.objects: dict[str, tuple[bytes, str]] = {}
+
+    async def upload(self, data, folder, name, extension):
+        public_id = f"{folder}/{name}"
+        self.objects.setdefault(public_id, (bytes(data), extension))
+        return self.url(public_id, extension), public_id
+
+    async def destroy(self, public_id):
+        self.objects.pop(public_id, None)
+
+    async def fetch(self, url):
+        try:
+            return self.objects[self.public_id_from_url(url)][0]
+        except KeyError:
+            raise StorageError(f"No object for {url}")
+
+    def url(self, public_id, extension):
+        return f"memory://{public_id}.{extension}"
+
+    def public_id_from_url(self, url):
+        if not url.startswith("memory://"):
+            return None
+        return url[len("memory://"):].rsplit(".", 1)[0]
+
+
+_storage: StorageBackend | None = None
+
+
+def get_storage() -> StorageBackend:
+    """The configured backend (settings.storage_backend), created on first use."""
+    global _storage
+    if _storage is None:
+        if settings.storage_backend == "cloudinary":
+            _storage = CloudinaryBackend(
+                settings.cloud_name, settings.cloud_api_key, settings.cloud_api_secret,
+                max_connections=settings.storage_max_connections,
+            )
+        elif settings.storage_backend == "local":
+            _storage = LocalBackend(settings.storage_local_root, settings.storage_local_url)
+        elif settings.storage_backend == "memory":
+            _storage = MemoryBackend()
+        else:
+            raise StorageError(f"Unknown storage backend: {settings.storage_backend}")
+    return _storage
+
+
+async def close_storage():
+    global _storage
+    if _storage is not None:
+        await _storage.aclose()
+        _storage = None
@@ -0,0 +1,136 @@
+# app/tasks.py
+import asyncio
+import random
+from datetime import timedelta
+from sqlalchemy import delete, func
+from core.settings import settings
+from . import crud, database, http_cache, models, similar
+from .storage import get_storage
+
+# Background jobs started from the app lifespan (core/scripts/create_db_records.py)
+
+_deletions_pending = asyncio.Event()
+
+
+def wake_asset_deletions():
+    """Nudge the deletion worker instead of waiting for its next poll."""
+    _deletions_pending.set()
+
+
+def _backoff(attempts: int) -> timedelta:
+    delay = min(settings.asset_deletion_max_backoff, 2 ** attempts * 5)
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+async def drain_asset_deletions(batch_size: int) -> int:
+    """
+    Destroy one batch of queued assets with a single bulk call, returns how many went.
+    The claim's row locks are held across the destroy, see crud.claim_asset_deletions.
+    """
+    async with database.AsyncSessionLocal() as db:
+        rows = await crud.claim_asset_deletions(db, batch_size)
+        if not rows:
+            await db.commit()
+            return 0
+        try:
+            await get_storage().destroy_many([row.public_id for row in rows])
+        except Exception as e:
+            # whole batch goes back in the queue, later each time
+            for row in rows:
+                row.attempts += 1
+                row.next_attempt_at = func.now() + _backoff(row.attempts)
+                row.last_error = str(e)[:500]
+            await db.commit()
+            print(f"[ASSETS] ❌ Bulk delete of {len(rows)} assets failed: {e}")
+            return 0
+        # still locked by the claim, so still unreferenced: the files are gone, their index rows go too
+        await db.execute(delete(models.Asset).where(models.Asset.public_id.in_([row.public_id for row in rows])))
+        await db.execute(delete(models.AssetDeletion).where(models.AssetDeletion.id.in_([row.id for row in rows])))
+        await db.commit()
+        return len(rows)
+
+
+async def run_asset_deletions():
+    """Drain the deletion queue forever, sweeping for orphans every orphan_sweep_interval."""
+    loop = asyncio.get_running_loop()
+    next_sweep = loop.time()
+    while True:
+        try:
+            if loop.time() >= next_sweep:
+                async with database.AsyncSessionLocal() as db:
+                    swept = await crud.sweep_orphan_assets(db, settings.orphan_sweep_grace)
+                if swept:
+                    print(f"[ASSETS] Queued {swept} orphaned assets for deletion")
+                next_sweep = loop.time() + settings.orphan_sweep_interval
+
+            while await drain_asset_deletions(settings.asset_deletion_batch_size) == settings.asset_deletion_batch_size:
+                pass  # full batch, there's probably more
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[ASSETS] ❌ Deletion worker error: {e}")
+
+        _deletions_pending.clear()
+        try:
+            await asyncio.wait_for(_deletions_pending.wait(), timeout=settings.asset_deletion_interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+def _on_invalidation(connection, pid, channel, payload):
+    http_cache.apply_notification(payload)
+
+
+async def run_cache_invalidations():
+    """
+    Listen for the response cache invalidations other workers publish (app/http_cache.py)
+    on a connection of its own. The cache is off whenever the listener isn't connected.
+    """
+    while True:
+        try:
+            async with database.engine.connect() as conn:
+                raw = (await conn.get_raw_connection()).driver_connection
+                await raw.add_listener(http_cache.INVALIDATION_CHANNEL, _on_invalidation)
+                http_cache.set_listening(True)
+                try:
+                    while True:
+                        await asyncio.sleep(settings.cache_listener_ping_interval)
+                        await raw.fetchval("SELECT 1")  # notice a dead connection
+                finally:
+                    http_cache.set_listening(False)
+                    if not raw.is_closed():
+                        await raw.remove_listener(http_cache.INVALIDATION_CHANNEL, _on_invalidation)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[CACHE] ❌ Invalidation listener lost, response cache off until it reconnects: {e}")
+        await asyncio.sleep(settings.cache_listener_retry)
+
+
+# rows that commit after a higher id was already loaded (concurrent inserts)
+# would be skipped for good, so every refresh re-reads a few ids back
+PHASH_REFRESH_OVERLAP = 1000
+
+
+async def load_phash_index() -> int:
+    """Add templates the near-duplicate index hasn't seen yet, returns how many rows were read."""
+    loaded = 0
+    after_id = max(0, similar.index.max_id - PHASH_REFRESH_OVERLAP) if len(similar.index) else 0
+    async with database.AsyncSessionLocal() as db:
+        async for rows in crud.iter_phashes(db, after_id=after_id):
+            for template_id, value in rows:
+                similar.index.add(template_id, value)
+            loaded += len(rows)
+    return loaded
+
+
+async def run_phash_refresh():
+    """Each worker has its own index, pick up templates created through the other workers."""
+    while True:
+        await asyncio.sleep(settings.similar_refresh_interval)
+        try:
+            await load_phash_index()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[SIMILAR] ❌ Index refresh failed: {e}")
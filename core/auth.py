@@ -7,7 +7,16 @@ from sqlalchemy.orm import Session
 from app import database
 from app.models import User
 from core.config import pwd_context, security, SECRET_KEY, ALGORITHM, EXPIRE_MINUTES
+from core.executors import hash_executor
+from core.cache import TTLCache
+from core.settings import settings
 from app import crud
+import time
+
+# Verified token -> User principal, so authenticated requests skip the jwt decode
+# and the user lookup. Entries expire with the token (or principal_cache_ttl,
+# which bounds how long a user changed in the database keeps being served).
+_principal_cache = TTLCache(maxsize=settings.principal_cache_size, ttl=settings.principal_cache_ttl)
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -15,6 +24,14 @@ def hash_password(password: str) -> str:
 def verify_password(plain: str, hashed: str) -> bool:
     return pwd_context.verify(plain, hashed)
 
+# async versions for request handlers, run in the bounded hash pool
+# so argon2 never blocks the event loop (503 when the pool is saturated)
+async def hash_password_async(password: str) -> str:
+    return await hash_executor.run(pwd_context.hash, password)
+
+async def verify_password_async(plain: str, hashed: str) -> bool:
+    return await hash_executor.run(pwd_context.verify, plain, hashed)
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=EXPIRE_MINUTES))
@@ -31,6 +48,15 @@ def decode_token(token: str) -> dict:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+def cache_principal(token: str, user: User, exp: int | float | None):
+    ttl = exp - time.time() if exp else None
+    if ttl is not None and ttl <= 0:
+        return
+    _principal_cache.set(token, user, ttl)
+
+def cache_stats() -> dict:
+    return _principal_cache.stats()
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(database.get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -38,8 +64,13 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         headers={"WWW-Authenticate": "Bearer"},
     )
     
+    token = credentials.credentials
+    user = _principal_cache.get(token)
+    if user is not None:
+        return user
+
     try:
-        payload = decode_token(credentials.credentials)
+        payload = decode_token(token)
         email: str = payload.get("sub")
         if email is None:
             raise credentials_exception
@@ -49,6 +80,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     user = await crud.get_user_by_email(db, email)
     if user is None:
         raise credentials_exception
+    cache_principal(token, user, payload.get("exp"))
     return user
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
@@ -0,0 +1,180 @@
+# core/executors.py
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from fastapi import HTTPException, status
+from . import metrics
+from .settings import settings
+
+
+def _busy(detail: str = "Server is busy, try again shortly"):
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=detail,
+        headers={"Retry-After": "1"},
+    )
+
+
+def _run_in_worker(fn, submitted: float, in_process: bool, args):
+    """
+    Runs in the worker. Returns (started, observations, error, result): the start
+    time for the queue wait metric, metrics recorded in a child process (replayed
+    by the parent, a child's registry is never scraped), and HTTPExceptions as
+    plain data since they don't survive pickling.
+    """
+    started = time.monotonic()  # system wide clock on linux, comparable across processes
+    if in_process:
+        metrics.start_capture()
+    result = error = None
+    try:
+        result = fn(*args)
+    except HTTPException as e:
+        error = (e.status_code, e.detail, e.headers)
+    finally:
+        observations = metrics.stop_capture() if in_process else None
+    return started, observations, error, result
+
+
+def _noop():
+    return None
+
+
+class BoundedExecutor:
+    """
+    Worker pool with admission control.
+    At most `workers + queue_size` jobs can be running or waiting at once,
+    anything past that is rejected with a 503 instead of queueing forever.
+    With processes=True the workers are processes (for GIL bound work), so
+    `fn` and its args must be picklable, see SharedBytes for big payloads.
+    """
+
+    def __init__(self, name: str, workers: int, queue_size: int, processes: bool = False, start_method: str = "spawn"):
+        self.name = name
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.processes = processes
+        self.start_method = start_method
+        self.in_flight = 0  # only touched from the event loop thread
+        self._pool = None
+        metrics.executor_in_flight.track(lambda: self.in_flight, executor=name)
+        metrics.executor_queue_depth.track(lambda: max(0, self.in_flight - self.workers), executor=name)
+        metrics.executor_workers.set(workers, executor=name)
+
+    @property
+    def pool(self):
+        # created lazily so importing this module doesn't spawn threads/processes
+        if self._pool is None:
+            if self.processes:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context(self.start_method)
+                )
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        return self._pool
+
+    async def run(self, fn, *args):
+        if self.in_flight >= self.capacity:
+            metrics.executor_rejected.inc(executor=self.name)
+            raise _busy()
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            submitted = time.monotonic()
+            try:
+                started, observations, error, result = await loop.run_in_executor(
+                    self.pool, _run_in_worker, fn, submitted, self.processes, args
+                )
+            except BrokenProcessPool:
+                # a worker died (OOM killer, segfault in a codec), start over with a fresh pool
+                print(f"[{self.name}] worker process died, restarting the pool")
+                self.shutdown()
+                raise _busy()
+            metrics.executor_wait.observe(max(0.0, started - submitted), executor=self.name)
+            if observations:
+                metrics.replay(observations)
+            if error is not None:
+                code, detail, headers = error
+                raise HTTPException(status_code=code, detail=detail, headers=headers)
+            return result
+        finally:
+            self.in_flight -= 1
+
+    async def prewarm(self):
+        """Start every worker now (spawned processes take a while to import), not on the first request."""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.pool, _noop) for _ in range(self.workers)))
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# --- Shared memory --- #
+# Passing a 20MB upload as an argument pickles it through the pool's pipe
+# (several copies, and the pipe is one at a time). Instead the parent copies it
+# once into a shared memory block and only the block's name goes through the pipe.
+class SharedBytes:
+    """Parent side: a shared memory block holding `size` bytes, unlinked on exit."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def write(self, data) -> "SharedBytes":
+        self.shm.buf[: len(data)] = data
+        return self
+
+    def read_from(self, fp, chunk_size: int = 1024 * 1024) -> "SharedBytes":
+        """Fill the block from a file object (blocking, run it on io_executor for spooled uploads)."""
+        fp.seek(0)
+        pos = 0
+        while pos < self.size:
+            chunk = fp.read(min(chunk_size, self.size - pos))
+            if not chunk:
+                break
+            self.shm.buf[pos : pos + len(chunk)] = chunk
+            pos += len(chunk)
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def read_shared(name: str, size: int) -> bytes:
+    """Worker side: the bytes of a SharedBytes block, by name."""
+    # pool workers share the parent's resource tracker, so attaching here doesn't
+    # get the block unlinked when the worker exits, the parent's unlink stays the only one
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        with shm.buf[:size] as view:
+            return bytes(view)
+    finally:
+        shm.close()
+
+
+# argon2 releases the GIL, so threads give real parallelism here.
+# Each hash allocates ~100MB (passlib default memory_cost), keep the pool small.
+hash_executor = BoundedExecutor("hash", settings.hash_workers, settings.hash_queue_size)
+
+# Pillow decode/resize/encode of uploads, in processes so it can't hold the GIL
+# against the event loop (app/cloud.py)
+image_executor = BoundedExecutor(
+    "image", settings.image_workers, settings.image_queue_size,
+    processes=True, start_method=settings.image_start_method,
+)
+
+# blocking file/network calls that have no async API (local storage backend,
+# reading spooled uploads), kept off the default executor
+io_executor = BoundedExecutor("io", settings.io_workers, settings.io_queue_size)
@@ -0,0 +1,274 @@
+# core/metrics.py
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# Prometheus text format metrics, served on GET /metrics. Kept to plain
+# counters and fixed-bucket histograms so recording is a lock, a bisect and
+# a couple of adds, cheap enough to leave on for every request. Values are
+# per process, Prometheus sums them across workers.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: list["_Metric"] = []
+_capture: list | None = None  # see start_capture
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.label_names)
+
+    def samples(self):
+        return []
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines += [f"{name}{_labels(names, values)} {value}" for name, names, values, value in self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, self.label_names, key, value) for key, value in items]
+
+
+class Gauge(_Metric):
+    """Set directly, or computed at scrape time from `track(fn, **labels)`."""
+    type = "gauge"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple, float] = {}
+        self._callbacks: dict[tuple, callable] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def track(self, fn, **labels):
+        self._callbacks[self._key(labels)] = fn
+
+    def samples(self):
+        with self._lock:
+            items = dict(self._values)
+        for key, fn in list(self._callbacks.items()):
+            try:
+                items[key] = fn()
+            except Exception:
+                continue
+        return [(self.name, self.label_names, key, value) for key, value in items.items()]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per bucket counts..., +Inf count, sum]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        if _capture is not None:
+            _capture.append((self.name, value, labels))
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[i] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        st = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - st, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        out = []
+        names = (*self.label_names, "le")
+        for key, counts in items:
+            total = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                total += count
+                out.append((f"{self.name}_bucket", names, (*key, bound), total))
+            out.append((f"{self.name}_count", self.label_names, key, total))
+            out.append((f"{self.name}_sum", self.label_names, key, counts[-1]))
+        return out
+
+
+def render() -> str:
+    return "\n".join(m.render() for m in _registry) + "\n"
+
+
+# Worker processes (core/executors.py) have their own copy of every metric that
+# nobody scrapes: they capture histogram observations per job and send them back
+# with the result, the parent replays them into its registry.
+def start_capture():
+    global _capture
+    _capture = []
+
+
+def stop_capture() -> list:
+    global _capture
+    captured, _capture = _capture or [], None
+    return captured
+
+
+def replay(observations):
+    by_name = {m.name: m for m in _registry if isinstance(m, Histogram)}
+    for name, value, labels in observations:
+        if name in by_name:
+            by_name[name].observe(value, **labels)
+
+
+# --- HTTP --- #
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Request latency by route template", ("method", "route", "status"))
+http_requests_in_progress = Gauge("http_requests_in_progress", "Requests being handled")
+
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware (no BaseHTTPMiddleware task/stream overhead). Labels use
+    the matched route's path template, so /templates/5 and /templates/6 share a series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_progress.inc()
+        st = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_progress.dec()
+            route = scope.get("route")
+            http_request_duration.observe(
+                time.perf_counter() - st,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status_code,
+            )
+
+
+# --- Database --- #
+db_query_duration = Histogram("db_query_duration_seconds", "SQL statement execution time", ("engine",))
+db_pool_checkout_wait = Histogram(
+    "db_pool_checkout_wait_seconds", "Time to get a connection from the pool (includes connecting)", ("engine",))
+db_pool_checked_out = Gauge("db_pool_checked_out", "Connections currently in use", ("engine",))
+db_pool_open = Gauge("db_pool_open", "Connections open (idle + in use)", ("engine",))
+db_pool_size = Gauge("db_pool_size", "Configured pool size (overflow excluded)", ("engine",))
+
+
+class TimedPool(AsyncAdaptedQueuePool):
+    """The default async pool, timing how long each checkout waits (pass as poolclass=)."""
+    metrics_label = "primary"
+
+    def _do_get(self):
+        st = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_checkout_wait.observe(time.perf_counter() - st, engine=self.metrics_label)
+
+
+def instrument_engine(engine: AsyncEngine, label: str):
+    """Statement timing through engine events plus pool gauges read at scrape time."""
+    sync_engine = engine.sync_engine
+    pool = sync_engine.pool
+    if isinstance(pool, TimedPool):
+        pool.metrics_label = label
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        db_query_duration.observe(time.perf_counter() - conn.info["query_start"].pop(), engine=label)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(context):
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+    if hasattr(pool, "checkedout"):
+        db_pool_checked_out.track(pool.checkedout, engine=label)
+        db_pool_open.track(lambda: pool.checkedin() + pool.checkedout(), engine=label)
+        db_pool_size.track(pool.size, engine=label)
+
+
+# --- Images (app/cloud.py) --- #
+image_stage_duration = Histogram(
+    "image_stage_seconds", "Image pipeline time per stage (decode, render, encode, upload)", ("stage",))
+
+
+# --- Executors (core/executors.py) --- #
+executor_workers = Gauge("executor_workers", "Worker threads/processes per executor", ("executor",))
+executor_in_flight = Gauge("executor_in_flight", "Jobs running or queued", ("executor",))
+executor_queue_depth = Gauge("executor_queue_depth", "Jobs waiting for a free worker", ("executor",))
+executor_wait = Histogram("executor_queue_wait_seconds", "Time from submit to a worker picking the job up", ("executor",))
+executor_rejected = Counter("executor_rejected_total", "Jobs turned away with a 503 because the queue was full", ("executor",))
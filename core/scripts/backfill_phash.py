@@ -0,0 +1,73 @@
+"""
+Compute Template.phash (app/similar.py) for templates uploaded before it existed.
+
+Fetches each image from storage and hashes it on the image worker processes,
+a batch at a time. Safe to stop and rerun, only rows without a hash are read.
+Running API workers pick the new hashes up within similar_refresh_interval.
+
+    python -m core.scripts.backfill_phash --batch 200 --concurrency 8
+"""
+import argparse
+import asyncio
+import io
+import time
+from sqlalchemy import select, update
+from app import cloud, database, models, similar
+from app.storage import close_storage, get_storage
+from core.executors import image_executor
+
+
+def _hash_image(data: bytes) -> int:
+    with cloud._open_image(io.BytesIO(data)) as img:
+        return similar.dhash(cloud._fit(img, 256))
+
+
+async def backfill(batch: int, concurrency: int):
+    sem = asyncio.Semaphore(concurrency)
+    done = failed = 0
+    last_id = 0
+    st = time.perf_counter()
+
+    async def one(template_id: int, public_id: str):
+        async with sem:
+            data = await get_storage().fetch(cloud.stored_url(public_id))
+            return template_id, await image_executor.run(_hash_image, data)
+
+    while True:
+        async with database.AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(models.Template.id, models.Template.image_public_id)
+                .where(models.Template.phash.is_(None), models.Template.id > last_id)
+                .order_by(models.Template.id)
+                .limit(batch)
+            )).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            results = await asyncio.gather(*(one(r.id, r.image_public_id) for r in rows), return_exceptions=True)
+            for row, result in zip(rows, results):
+                if isinstance(result, BaseException):
+                    failed += 1
+                    print(f"template {row.id}: {result!r}")
+                    continue
+                template_id, value = result
+                await db.execute(
+                    update(models.Template)
+                    .where(models.Template.id == template_id)
+                    .values(phash=similar.to_db(value), updated_at=models.Template.updated_at)
+                )
+                done += 1
+            await db.commit()
+        print(f"{done} hashed, {failed} failed, {done / (time.perf_counter() - st):.1f}/s")
+
+    image_executor.shutdown()
+    await close_storage()
+    await database.dispose_engines()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    asyncio.run(backfill(args.batch, args.concurrency))
@@ -0,0 +1,73 @@
+"""
+Event loop responsiveness during an upload spike, fully offline.
+
+Processes a burst of large JPEGs the old way (asyncio.to_thread, default
+pool) and through cloud.process_image (image_executor worker processes,
+bytes handed over in shared memory), while a probe coroutine measures how
+late the event loop wakes it up. That lag is what every other request
+waits on.
+
+    STORAGE_BACKEND=memory python -m core.scripts.bench_executors --uploads 24 --width 4000 --height 3000
+"""
+import argparse
+import asyncio
+import io
+import statistics
+import time
+from PIL import Image
+from app import cloud
+from core.executors import image_executor
+
+
+def make_jpeg(width: int, height: int) -> bytes:
+    noise = Image.effect_noise((width // 4, height // 4), 50).resize((width, height))
+    buffer = io.BytesIO()
+    Image.merge("RGB", (noise, noise, noise)).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+async def probe(lags: list, stop: asyncio.Event, interval: float = 0.005):
+    while not stop.is_set():
+        st = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append((time.perf_counter() - st - interval) * 1000)
+
+
+async def run(label: str, job, uploads: int, data: bytes):
+    lags, stop = [], asyncio.Event()
+    prober = asyncio.create_task(probe(lags, stop))
+    st = time.perf_counter()
+    results = await asyncio.gather(*(job(data) for _ in range(uploads)), return_exceptions=True)
+    elapsed = time.perf_counter() - st
+    stop.set()
+    await prober
+    rejected = sum(isinstance(r, Exception) for r in results)
+    lags.sort()
+    print(f"{label:<10}{elapsed:>10.2f}{(uploads - rejected) / elapsed:>10.1f}{rejected:>10}"
+          f"{statistics.median(lags):>12.2f}{lags[int(len(lags) * 0.99)]:>12.2f}{lags[-1]:>12.2f}")
+
+
+async def main(uploads: int, width: int, height: int):
+    data = make_jpeg(width, height)
+
+    async def threaded(data):
+        return await asyncio.to_thread(cloud._process_image_sync, data)
+
+    async def processes(data):
+        return await cloud.process_image(data)
+
+    await image_executor.prewarm()
+    print(f"{uploads} uploads of {len(data) / 1e6:.1f}MB ({width}x{height}), {image_executor.workers} image workers")
+    print(f"{'path':<10}{'seconds':>10}{'img/s':>10}{'rejected':>10}{'lag p50 ms':>12}{'lag p99 ms':>12}{'lag max ms':>12}")
+    await run("threads", threaded, uploads, data)
+    await run("processes", processes, uploads, data)
+    image_executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=24)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    args = parser.parse_args()
+    asyncio.run(main(args.uploads, args.width, args.height))
@@ -0,0 +1,82 @@
+"""
+Image ingestion benchmark: memory and latency of processing large uploads.
+
+Compares the old path (read everything, full-res decode, convert, thumbnail)
+with cloud._process_image_sync (lazy open, draft/reduce decode). Each path
+runs in a fresh process so peak RSS is comparable.
+
+    python -m core.scripts.bench_images --count 10 --width 6000 --height 4000
+"""
+import argparse
+import io
+import multiprocessing as mp
+import resource
+import statistics
+import time
+from PIL import Image
+
+
+def make_corpus(count: int, width: int, height: int) -> list[bytes]:
+    """Phone-photo sized JPEGs with enough detail that they don't compress to nothing."""
+    corpus = []
+    for i in range(count):
+        noise = Image.effect_noise((width // 4, height // 4), 40 + i).resize((width, height))
+        img = Image.merge("RGB", (noise, Image.linear_gradient("L").resize((width, height)), noise))
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=92)
+        corpus.append(buffer.getvalue())
+    return corpus
+
+
+def legacy_process(file_bytes, max_size):
+    img = Image.open(io.BytesIO(file_bytes))
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    img.thumbnail((max_size, max_size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    img.save(buffer, format="WEBP", quality=75, method=0)
+    return buffer
+
+
+def current_process(file_bytes, max_size):
+    from app.cloud import _process_image_sync
+    # uploads are spooled files, hand it a file object like the route does
+    return _process_image_sync(io.BytesIO(file_bytes), max_size)[0]
+
+
+def run(path: str, corpus: list[bytes], max_size: int, out):
+    fn = legacy_process if path == "legacy" else current_process
+    import app.cloud  # noqa: F401  keep import cost out of the numbers
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings = []
+    for data in corpus:
+        st = time.perf_counter()
+        fn(data, max_size)
+        timings.append((time.perf_counter() - st) * 1000)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    out.put((path, max_size, statistics.median(timings), max(timings), (peak - base_rss) / 1024))
+
+
+def main(count: int, width: int, height: int):
+    corpus = make_corpus(count, width, height)
+    avg_mb = sum(map(len, corpus)) / len(corpus) / 1024 / 1024
+    print(f"corpus: {count} x {width}x{height} JPEG, {avg_mb:.1f}MB avg")
+    print(f"{'path':<10}{'target':>8}{'p50 ms':>10}{'max ms':>10}{'peak RSS +MB':>14}")
+    ctx = mp.get_context("fork")
+    for max_size in (2048, 512):
+        for path in ("legacy", "current"):
+            out = ctx.Queue()
+            proc = ctx.Process(target=run, args=(path, corpus, max_size, out))
+            proc.start()
+            name, size, p50, worst, rss = out.get()
+            proc.join()
+            print(f"{name:<10}{size:>8}{p50:>10.1f}{worst:>10.1f}{rss:>14.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=10)
+    parser.add_argument("--width", type=int, default=6000)
+    parser.add_argument("--height", type=int, default=4000)
+    args = parser.parse_args()
+    main(args.count, args.width, args.height)
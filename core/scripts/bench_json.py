@@ -0,0 +1,69 @@
+"""
+JSON microbenchmarks for the variant/template write path, 50 text elements.
+
+parse:     the text_elements form field -> List[TextElement]
+           (json.loads + per element construction vs one TypeAdapter.validate_json)
+serialize: a create response (VariantOut with its text_elements)
+           (jsonable_encoder + json.dumps vs TypeAdapter.dump_json, see routes.json_response)
+
+    python -m core.scripts.bench_json --elements 50 --number 2000
+"""
+import argparse
+import json
+import random
+import timeit
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from app import routes, schemas
+
+
+def make_payload(n: int) -> str:
+    rng = random.Random(n)
+    return json.dumps([
+        {
+            "id": str(1700000000000 + i), "text": "WHEN THE BENCHMARK FINALLY PASSES", "x": rng.uniform(0, 800),
+            "y": rng.uniform(0, 1200), "font_size": rng.choice([24, 36, 48]), "color": "#ffffff", "rotation": 0,
+            "width": 300, "height": 50, "outline_size": 3, "text_align": "center", "shadow_blur": 2.0,
+        }
+        for i in range(n)
+    ])
+
+
+def legacy_parse(raw: str):
+    parsed = json.loads(raw)
+    for i in parsed:
+        i["id"] = float(i["id"])
+    return [schemas.TextElement(**t) for t in parsed]
+
+
+def legacy_serialize(adapter: TypeAdapter, obj) -> bytes:
+    # what FastAPI did with response_model before serializing through pydantic-core
+    return json.dumps(jsonable_encoder(adapter.validate_python(obj)), ensure_ascii=False).encode()
+
+
+def main(elements: int, number: int):
+    raw = make_payload(elements)
+    assert legacy_parse(raw) == routes.parse_text_elements(raw)
+    variant = {
+        "id": 1, "owner_id": 1, "source_id": 1, "thumbnail_url": "memory://thumbnail/abc.webp",
+        "text_elements": [el.model_dump() for el in routes.parse_text_elements(raw)],
+    }
+    cases = [
+        ("parse", "legacy", lambda: legacy_parse(raw)),
+        ("parse", "current", lambda: routes.parse_text_elements(raw)),
+        ("serialize", "legacy", lambda: legacy_serialize(routes.variant_adapter, variant)),
+        ("serialize", "current", lambda: routes.dump_json(routes.variant_adapter, variant)),
+    ]
+    print(f"{elements} text elements, {len(raw)} bytes of JSON, best of 5 x {number}")
+    print(f"{'step':<12}{'path':<10}{'us/op':>10}")
+    for step, path, fn in cases:
+        best = min(timeit.repeat(fn, number=number, repeat=5)) / number
+        print(f"{step:<12}{path:<10}{best * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--elements", type=int, default=50)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+    main(args.elements, args.number)
@@ -0,0 +1,89 @@
+"""
+Login throughput benchmark.
+
+Measures GET /templates latency on its own, then again while a pool of
+clients hammers POST /login. With hashing off the event loop the /templates
+p99 should stay roughly flat between the two phases.
+
+    python -m core.scripts.bench_login --url http://localhost:8000 --logins 200 --concurrency 16
+"""
+import argparse
+import asyncio
+import time
+import uuid
+import httpx
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    k = min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))
+    return samples[k]
+
+
+async def probe_templates(client, stop: asyncio.Event, interval: float):
+    """Hit /templates at a steady rate until stopped, return latencies in ms."""
+    latencies = []
+    while not stop.is_set():
+        st = time.perf_counter()
+        await client.get("/templates")
+        latencies.append((time.perf_counter() - st) * 1000)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def login_worker(client, creds, queue: asyncio.Queue, results: list):
+    while True:
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        st = time.perf_counter()
+        res = await client.post("/login", json=creds)
+        results.append(((time.perf_counter() - st) * 1000, res.status_code))
+
+
+async def main(url: str, logins: int, concurrency: int, probe_seconds: float, interval: float):
+    creds = {"email": f"bench-{uuid.uuid4().hex[:8]}@example.com", "password": "bench-password"}
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+        res = await client.post("/register", json=creds)
+        res.raise_for_status()
+
+        # phase 1: idle baseline
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_templates(client, stop, interval))
+        await asyncio.sleep(probe_seconds)
+        stop.set()
+        baseline = await probe
+
+        # phase 2: same probe while logins are running
+        queue = asyncio.Queue()
+        for _ in range(logins):
+            queue.put_nowait(None)
+        results = []
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_templates(client, stop, interval))
+        st = time.perf_counter()
+        await asyncio.gather(*(login_worker(client, creds, queue, results) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - st
+        stop.set()
+        loaded = await probe
+
+    ok = [ms for ms, code in results if code == 200]
+    rejected = sum(1 for _, code in results if code == 503)
+    print(f"logins: {len(ok)} ok, {rejected} rejected (503) in {elapsed:.2f}s -> {len(ok) / elapsed:.1f}/s")
+    print(f"login latency    p50={percentile(ok, 50):8.1f}ms  p99={percentile(ok, 99):8.1f}ms")
+    print(f"/templates idle  p50={percentile(baseline, 50):8.1f}ms  p99={percentile(baseline, 99):8.1f}ms  (n={len(baseline)})")
+    print(f"/templates load  p50={percentile(loaded, 50):8.1f}ms  p99={percentile(loaded, 99):8.1f}ms  (n={len(loaded)})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--probe-seconds", type=float, default=5.0)
+    parser.add_argument("--interval", type=float, default=0.02)
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.logins, args.concurrency, args.probe_seconds, args.interval))
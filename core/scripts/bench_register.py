@@ -0,0 +1,66 @@
+"""
+Concurrent signup benchmark.
+
+Phase 1 registers `--signups` fresh users from `--concurrency` clients and
+reports throughput and latency. Phase 2 fires `--race` registrations for one
+email at the same instant: exactly one should get 201, the rest a clean 400
+(no 500s from a unique violation slipping through a check-then-insert).
+
+    python -m core.scripts.bench_register --url http://localhost:8000 --signups 500 --concurrency 32
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from collections import Counter
+import httpx
+from core.scripts.bench_login import percentile
+
+
+async def signup_worker(client, queue: asyncio.Queue, results: list):
+    while True:
+        try:
+            email = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        st = time.perf_counter()
+        res = await client.post("/register", json={"email": email, "password": "bench-password"})
+        results.append(((time.perf_counter() - st) * 1000, res.status_code))
+
+
+async def main(url: str, signups: int, concurrency: int, race: int):
+    run = uuid.uuid4().hex[:8]
+    limits = httpx.Limits(max_connections=max(concurrency, race))
+    async with httpx.AsyncClient(base_url=url, timeout=60, limits=limits) as client:
+        # phase 1: distinct users, same short email prefix so generated usernames collide often
+        queue = asyncio.Queue()
+        for i in range(signups):
+            queue.put_nowait(f"bench+{run}-{i}@example.com")
+        results = []
+        st = time.perf_counter()
+        await asyncio.gather(*(signup_worker(client, queue, results) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - st
+
+        # phase 2: everyone signs up as the same person at once
+        email = f"race-{run}@example.com"
+        race_res = await asyncio.gather(*(
+            client.post("/register", json={"email": email, "password": "bench-password"}) for _ in range(race)
+        ))
+
+    ok = [ms for ms, code in results if code == 201]
+    codes = Counter(code for _, code in results)
+    print(f"signups: {len(ok)} created in {elapsed:.2f}s -> {len(ok) / elapsed:.1f}/s, status codes {dict(codes)}")
+    print(f"signup latency  p50={percentile(ok, 50):8.1f}ms  p95={percentile(ok, 95):8.1f}ms  p99={percentile(ok, 99):8.1f}ms")
+    race_codes = Counter(res.status_code for res in race_res)
+    verdict = "ok" if race_codes.get(201) == 1 and set(race_codes) <= {201, 400} else "UNEXPECTED"
+    print(f"same-email race x{race}: {dict(race_codes)} -> {verdict}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--signups", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--race", type=int, default=16)
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.signups, args.concurrency, args.race))
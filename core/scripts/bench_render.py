@@ -0,0 +1,86 @@
+"""
+Variant rendering throughput benchmark, fully offline (memory storage backend).
+
+Renders meme-style captions onto a generated template at several
+concurrency levels, with cold caches (fonts, layout, base bitmap cleared)
+and warm ones.
+
+    STORAGE_BACKEND=memory python -m core.scripts.bench_render --renders 200 --elements 3
+"""
+import argparse
+import asyncio
+import io
+import random
+import time
+from PIL import Image
+from app import render, schemas
+from app.storage import MemoryBackend, get_storage
+from types import SimpleNamespace
+
+CAPTIONS = ["ONE DOES NOT SIMPLY", "WALK INTO MORDOR", "SUCH WOW", "MUCH BENCHMARK", "THIS IS FINE",
+            "ME EXPLAINING", "NOBODY:", "WHEN THE P99 DROPS", "STONKS", "IT'S OVER 9000"]
+
+
+def make_elements(n: int, seed: int) -> list[schemas.TextElement]:
+    rng = random.Random(seed)
+    return [
+        schemas.TextElement(
+            text=" ".join(rng.sample(CAPTIONS, 2)), x=rng.uniform(0, 800), y=rng.uniform(0, 1200),
+            font_size=rng.choice([36, 48, 64, 80]), color="#ffffff", outline_size=3, width=1200,
+            text_align="center", rotation=rng.choice([0, 0, -8, 12]), shadow_blur=4, shadow_offset_x=3,
+            shadow_offset_y=3, shadow_opacity=0.5,
+        )
+        for _ in range(n)
+    ]
+
+
+def clear_caches():
+    render._base_images.clear()
+    render._load_font.cache_clear()
+    render.layout_text.cache_clear()
+
+
+async def run(template, jobs, concurrency: int) -> float:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(elements):
+        async with sem:
+            await render.render_variant(template, elements)
+
+    st = time.perf_counter()
+    await asyncio.gather(*(one(elements) for elements in jobs))
+    return time.perf_counter() - st
+
+
+async def main(renders: int, elements: int, distinct: int):
+    storage = get_storage()
+    if not isinstance(storage, MemoryBackend):
+        raise SystemExit("run with STORAGE_BACKEND=memory")
+    buffer = io.BytesIO()
+    Image.effect_noise((2048, 1536), 60).convert("RGB").save(buffer, format="WEBP")
+    url, public_id = await storage.upload(buffer.getvalue(), "templates", "bench", "webp")
+    template = SimpleNamespace(image_url=url, image_public_id=public_id)
+
+    # `distinct` caption sets reused round robin, like many users remixing one template
+    pool = [make_elements(elements, seed) for seed in range(distinct)]
+    jobs = [pool[i % distinct] for i in range(renders)]
+
+    print(f"{renders} renders, {elements} elements each, {distinct} distinct caption sets, "
+          f"{render.render_executor.workers} render workers")
+    print(f"{'caches':<8}{'concurrency':>12}{'renders/s':>12}{'ms/render':>12}")
+    for concurrency in (1, 4, 16):
+        for label in ("cold", "warm"):
+            if label == "cold":
+                clear_caches()
+            elapsed = await run(template, jobs, concurrency)
+            print(f"{label:<8}{concurrency:>12}{renders / elapsed:>12.1f}{elapsed / renders * 1000:>12.2f}")
+    render.render_executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--renders", type=int, default=200)
+    parser.add_argument("--elements", type=int, default=3)
+    parser.add_argument("--distinct", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.renders, args.elements, args.distinct))
@@ -0,0 +1,111 @@
+"""
+Template search benchmark: ILIKE scan vs tsvector/trigram search.
+
+Builds a generated corpus in a scratch table (same search columns and
+indexes as `templates`) and times both query shapes over a set of terms.
+
+    python -m core.scripts.bench_search --database-url postgresql+asyncpg://localhost/bench --rows 1000000
+"""
+import argparse
+import asyncio
+import random
+import time
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from app.models import SEARCH_DOCUMENT
+from app.search import SEARCH_CONFIG, to_prefix_tsquery
+
+WORDS = [
+    "distracted", "boyfriend", "drake", "hotline", "bling", "doge", "cat", "woman", "yelling",
+    "change", "my", "mind", "expanding", "brain", "galaxy", "this", "is", "fine", "dog",
+    "success", "kid", "one", "does", "not", "simply", "surprised", "pikachu", "stonks",
+    "two", "buttons", "panik", "kalm", "always", "has", "been", "astronaut", "gru", "plan",
+]
+TERMS = ["dist", "boyfriend", "surprised pika", "stonk", "cat yell", "galxy", "gru plan", "zzzz"]
+
+SETUP = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "DROP TABLE IF EXISTS bench_templates",
+    f"""CREATE TABLE bench_templates (
+        id serial PRIMARY KEY,
+        name varchar NOT NULL,
+        description text,
+        created_at timestamp DEFAULT now(),
+        search_vector tsvector GENERATED ALWAYS AS ({SEARCH_DOCUMENT}) STORED
+    )""",
+]
+INDEXES = [
+    "CREATE INDEX ON bench_templates USING gin (search_vector)",
+    "CREATE INDEX ON bench_templates USING gin (name gin_trgm_ops)",
+    "ANALYZE bench_templates",
+]
+
+ILIKE_SQL = text("""
+    SELECT id FROM bench_templates
+    WHERE name ILIKE :pattern OR description ILIKE :pattern
+    ORDER BY created_at DESC LIMIT 10
+""")
+SEARCH_SQL = text(f"""
+    SELECT id FROM bench_templates
+    WHERE search_vector @@ to_tsquery('{SEARCH_CONFIG}', :tsq) OR name % :q
+    ORDER BY ts_rank_cd(search_vector, to_tsquery('{SEARCH_CONFIG}', :tsq)) + similarity(name, :q) DESC,
+             created_at DESC, id DESC
+    LIMIT 10
+""")
+
+
+async def populate(conn, rows: int):
+    # generate the corpus server side, shipping 1M rows over the wire would dominate
+    words = "ARRAY[" + ",".join(f"'{w}'" for w in WORDS) + "]"
+    pick = f"({words})[1 + floor(random() * {len(WORDS)})::int]"
+    await conn.execute(text(f"""
+        INSERT INTO bench_templates (name, description, created_at)
+        SELECT {pick} || ' ' || {pick} || ' ' || {pick},
+               {pick} || ' ' || {pick} || ' ' || {pick} || ' ' || {pick} || ' ' || {pick},
+               now() - (g || ' seconds')::interval
+        FROM generate_series(1, :rows) AS g
+    """), {"rows": rows})
+
+
+async def time_query(conn, sql, params, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        st = time.perf_counter()
+        await conn.execute(sql, params)
+        timings.append(time.perf_counter() - st)
+    timings.sort()
+    return timings[len(timings) // 2] * 1000
+
+
+async def main(database_url: str, rows: int, repeat: int, keep: bool):
+    engine = create_async_engine(database_url)
+    async with engine.begin() as conn:
+        for stmt in SETUP:
+            await conn.execute(text(stmt))
+        st = time.perf_counter()
+        await populate(conn, rows)
+        for stmt in INDEXES:
+            await conn.execute(text(stmt))
+        print(f"corpus: {rows} rows built in {time.perf_counter() - st:.1f}s")
+
+    random.seed(0)
+    print(f"{'term':<18}{'ilike ms':>12}{'search ms':>12}{'speedup':>10}")
+    async with engine.connect() as conn:
+        for term in TERMS:
+            ilike_ms = await time_query(conn, ILIKE_SQL, {"pattern": f"%{term}%"}, repeat)
+            search_ms = await time_query(conn, SEARCH_SQL, {"tsq": to_prefix_tsquery(term), "q": term}, repeat)
+            print(f"{term:<18}{ilike_ms:>12.2f}{search_ms:>12.2f}{ilike_ms / max(search_ms, 1e-6):>9.1f}x")
+        if not keep:
+            await conn.execute(text("DROP TABLE bench_templates"))
+            await conn.commit()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--keep", action="store_true", help="keep the bench_templates table afterwards")
+    args = parser.parse_args()
+    asyncio.run(main(args.database_url, args.rows, args.repeat, args.keep))
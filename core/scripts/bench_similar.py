@@ -0,0 +1,63 @@
+"""
+Near-duplicate index benchmark (app/similar.py), fully offline.
+
+Fills a PhashIndex with random 64-bit hashes plus planted near-duplicates
+(a few bits flipped), then times lookups at several distances and checks
+them against a linear scan on a sample.
+
+    python -m core.scripts.bench_similar --templates 1000000 --queries 2000
+"""
+import argparse
+import random
+import resource
+import statistics
+import time
+from app.similar import PhashIndex, distance
+
+
+def main(templates: int, queries: int, seed: int):
+    rng = random.Random(seed)
+    hashes = [rng.getrandbits(64) for _ in range(templates)]
+    # every 100th template gets a re-upload a couple of bits off
+    for i in range(0, templates, 100):
+        flipped = hashes[i]
+        for bit in rng.sample(range(64), rng.randint(0, 4)):
+            flipped ^= 1 << bit
+        hashes.append(flipped)
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    index = PhashIndex()
+    st = time.perf_counter()
+    for template_id, value in enumerate(hashes, 1):
+        index.add(template_id, value)
+    build = time.perf_counter() - st
+    grown = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024
+    print(f"{len(index)} hashes indexed in {build:.1f}s, ~{grown:.0f}MB")
+
+    probes = [hashes[rng.randrange(len(hashes))] for _ in range(queries)]
+    print(f"{'distance':>8}{'p50 ms':>10}{'p99 ms':>10}{'hits/query':>12}{'exact':>8}")
+    for max_distance in (3, 6, 8, 11):
+        timings, hits = [], 0
+        for value in probes:
+            st = time.perf_counter()
+            found = index.near(value, max_distance, limit=20)
+            timings.append((time.perf_counter() - st) * 1000)
+            hits += len(found)
+        # linear scan on a few queries, the index must find the same ids
+        exact = all(
+            {i for i, _ in index.near(value, max_distance, limit=len(hashes))}
+            == {i for i, h in enumerate(hashes, 1) if distance(value, h) <= max_distance}
+            for value in probes[:5]
+        )
+        timings.sort()
+        print(f"{max_distance:>8}{statistics.median(timings):>10.3f}{timings[int(len(timings) * 0.99)]:>10.3f}"
+              f"{hits / queries:>12.2f}{str(exact):>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--templates", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    main(args.templates, args.queries, args.seed)
@@ -0,0 +1,134 @@
+"""
+Popularity sort benchmark: COUNT(*) over variants vs the denormalized counters.
+
+Builds scratch tables (bench_pop_templates / bench_pop_variants) with a skewed
+variant distribution, then times a "most remixed" and a "trending" first page
+computed from variants on every load against reading the maintained
+variant_count / trending_score columns through their indexes, plus the
+per-variant cost of keeping the counters up to date. trending_score is kept
+in log space like app/crud.py does, so there is no decay pass to time.
+
+    python -m core.scripts.bench_trending --database-url postgresql+asyncpg://localhost/bench --variants 10000000
+"""
+import argparse
+import asyncio
+import math
+import time
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from core.scripts.bench_search import time_query
+
+SETUP = [
+    "DROP TABLE IF EXISTS bench_pop_variants",
+    "DROP TABLE IF EXISTS bench_pop_templates",
+    """CREATE TABLE bench_pop_templates (
+        id serial PRIMARY KEY,
+        name varchar NOT NULL,
+        created_at timestamp DEFAULT now(),
+        variant_count integer NOT NULL DEFAULT 0,
+        trending_score double precision NOT NULL DEFAULT 0,
+        trending_updated_at timestamp DEFAULT now()
+    )""",
+    """CREATE TABLE bench_pop_variants (
+        id serial PRIMARY KEY,
+        source_id integer NOT NULL,
+        created_at timestamp DEFAULT now()
+    )""",
+]
+INDEXES = [
+    "CREATE INDEX ON bench_pop_variants (source_id, id)",
+    "CREATE INDEX ON bench_pop_templates (variant_count DESC, id DESC)",
+    "CREATE INDEX ON bench_pop_templates (trending_score DESC, id DESC)",
+    "ANALYZE bench_pop_templates",
+    "ANALYZE bench_pop_variants",
+]
+
+COUNT_POPULAR = text("""
+    SELECT t.id, count(v.id) AS n FROM bench_pop_templates t
+    JOIN bench_pop_variants v ON v.source_id = t.id
+    GROUP BY t.id ORDER BY n DESC, t.id DESC LIMIT 20
+""")
+COUNT_TRENDING = text("""
+    SELECT t.id, sum(exp(-extract(epoch FROM now() - v.created_at) / :tau)) AS score
+    FROM bench_pop_templates t JOIN bench_pop_variants v ON v.source_id = t.id
+    GROUP BY t.id ORDER BY score DESC, t.id DESC LIMIT 20
+""")
+INDEX_POPULAR = text("SELECT id, variant_count FROM bench_pop_templates ORDER BY variant_count DESC, id DESC LIMIT 20")
+INDEX_TRENDING = text("SELECT id, trending_score FROM bench_pop_templates ORDER BY trending_score DESC, id DESC LIMIT 20")
+BUMP = text("""
+    UPDATE bench_pop_templates SET variant_count = variant_count + 1,
+        trending_score = greatest(trending_score, k.now) + ln(1 + exp(-least(abs(trending_score - k.now), 700))),
+        trending_updated_at = now()
+    FROM (SELECT extract(epoch FROM now()::timestamp) / :tau AS now) AS k
+    WHERE id = :id
+""")
+
+
+async def populate(conn, templates: int, variants: int, tau: float):
+    await conn.execute(text("""
+        INSERT INTO bench_pop_templates (name, created_at)
+        SELECT 'template ' || g, now() - (g || ' minutes')::interval FROM generate_series(1, :n) AS g
+    """), {"n": templates})
+    # zipf-ish: a few templates get most of the remixes, spread over the last 30 days
+    await conn.execute(text("""
+        INSERT INTO bench_pop_variants (source_id, created_at)
+        SELECT 1 + floor(:n * power(random(), 3))::int, now() - random() * interval '30 days'
+        FROM generate_series(1, :v)
+    """), {"n": templates, "v": variants})
+    # what crud.create_variant would have maintained along the way: log(score now) + now/tau
+    await conn.execute(text("""
+        UPDATE bench_pop_templates t SET variant_count = v.n, trending_score = v.score, trending_updated_at = now()
+        FROM (
+            SELECT source_id, count(*) AS n,
+                ln(sum(exp(-extract(epoch FROM now()::timestamp - created_at) / :tau)))
+                    + extract(epoch FROM now()::timestamp) / :tau AS score
+            FROM bench_pop_variants GROUP BY source_id
+        ) AS v
+        WHERE t.id = v.source_id
+    """), {"tau": tau})
+
+
+async def main(database_url: str, templates: int, variants: int, repeat: int, keep: bool, half_life_hours: float):
+    tau = half_life_hours * 3600 / math.log(2)
+    engine = create_async_engine(database_url)
+    async with engine.begin() as conn:
+        for stmt in SETUP:
+            await conn.execute(text(stmt))
+        st = time.perf_counter()
+        await populate(conn, templates, variants, tau)
+        for stmt in INDEXES:
+            await conn.execute(text(stmt))
+        print(f"corpus: {templates} templates, {variants} variants built in {time.perf_counter() - st:.1f}s")
+
+    async with engine.connect() as conn:
+        params = {"tau": tau}
+        rows = [
+            ("popular", await time_query(conn, COUNT_POPULAR, {}, repeat), await time_query(conn, INDEX_POPULAR, {}, repeat)),
+            ("trending", await time_query(conn, COUNT_TRENDING, params, repeat), await time_query(conn, INDEX_TRENDING, {}, repeat)),
+        ]
+        print(f"{'sort':<12}{'count(*) ms':>14}{'index ms':>12}{'speedup':>10}")
+        for name, count_ms, index_ms in rows:
+            print(f"{name:<12}{count_ms:>14.2f}{index_ms:>12.2f}{count_ms / max(index_ms, 1e-6):>9.0f}x")
+
+        # write side: what every new variant costs
+        bump_ms = await time_query(conn, BUMP, {"tau": tau, "id": 1}, repeat * 20)
+        await conn.commit()
+        print(f"counter update per variant: {bump_ms:.3f} ms")
+
+        if not keep:
+            await conn.execute(text("DROP TABLE bench_pop_variants"))
+            await conn.execute(text("DROP TABLE bench_pop_templates"))
+            await conn.commit()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--templates", type=int, default=100_000)
+    parser.add_argument("--variants", type=int, default=10_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--half-life-hours", type=float, default=24.0)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch tables afterwards")
+    args = parser.parse_args()
+    asyncio.run(main(args.database_url, args.templates, args.variants, args.repeat, args.keep, args.half_life_hours))
@@ -1,46 +1,288 @@
-from app import database, models
+from app import database, models, tasks
+from app.storage import close_storage
+from core.executors import hash_executor, image_executor, io_executor
+from app.render import render_executor
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from sqlalchemy.exc import OperationalError
+from core.settings import settings
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError, ProgrammingError
+from sqlalchemy import text
 import asyncio
+import random
+import time
 
-async def init_models():
-    """Initialize database models with retries (Render-safe)."""
-    retries = 5
-    delay = 5  # seconds between retries
+# Versioned schema migrations. Startup reads the applied version from
+# schema_version (one query) and only runs what's newer, under an advisory lock
+# so several workers booting at once don't race. Steps are SQL strings or sync
+# callables run with the connection (conn.run_sync). Never edit an applied
+# migration, append a new version instead. Steps stay idempotent so databases
+# created before schema_version existed can run them all once. Spell out the
+# DDL rather than deriving it from app/models.py, which describes the latest
+# version: model changes need a migration of their own.
+MIGRATIONS = [
+    (1, "base tables", [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        """CREATE TABLE IF NOT EXISTS users (
+            id serial PRIMARY KEY,
+            email varchar,
+            username varchar UNIQUE,
+            hashed_password varchar,
+            is_active boolean,
+            is_superuser boolean,
+            is_staff boolean
+        )""",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_email ON users (email)",
+        "CREATE INDEX IF NOT EXISTS ix_users_id ON users (id)",
+        """CREATE TABLE IF NOT EXISTS templates (
+            id serial PRIMARY KEY,
+            name varchar NOT NULL,
+            description text,
+            text_elements jsonb,
+            tag varchar,
+            image_url varchar NOT NULL,
+            image_public_id varchar NOT NULL,
+            thumbnail_url varchar NOT NULL,
+            thumbnail_public_id varchar NOT NULL,
+            created_at timestamp,
+            updated_at timestamp,
+            owner_id integer REFERENCES users (id) ON DELETE CASCADE
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_templates_id ON templates (id)",
+        "CREATE INDEX IF NOT EXISTS ix_templates_name ON templates (name)",
+        "CREATE INDEX IF NOT EXISTS ix_templates_tag ON templates (tag)",
+        """CREATE TABLE IF NOT EXISTS variants (
+            id serial PRIMARY KEY,
+            text_elements jsonb,
+            thumbnail_url varchar NOT NULL,
+            thumbnail_public_id varchar NOT NULL,
+            owner_id integer REFERENCES users (id) ON DELETE CASCADE,
+            source_id integer REFERENCES templates (id) ON DELETE CASCADE
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_variants_id ON variants (id)",
+        # asset index (app/crud.py) and its deletion outbox (app/tasks.py)
+        """CREATE TABLE IF NOT EXISTS assets (
+            public_id varchar PRIMARY KEY,
+            secure_url varchar NOT NULL,
+            refcount integer NOT NULL,
+            created_at timestamp,
+            updated_at timestamp
+        )""",
+        """CREATE TABLE IF NOT EXISTS asset_deletions (
+            id serial PRIMARY KEY,
+            public_id varchar NOT NULL UNIQUE,
+            attempts integer NOT NULL,
+            next_attempt_at timestamp,
+            last_error text,
+            created_at timestamp
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_asset_deletions_next_attempt_at ON asset_deletions (next_attempt_at)",
+    ]),
+    (2, "template search (app/search.py)", [
+        f"ALTER TABLE templates ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        f"GENERATED ALWAYS AS ({models.SEARCH_DOCUMENT}) STORED",
+        "CREATE INDEX IF NOT EXISTS ix_templates_search_vector ON templates USING gin (search_vector)",
+        "CREATE INDEX IF NOT EXISTS ix_templates_name_trgm ON templates USING gin (name gin_trgm_ops)",
+    ]),
+    (3, "keyset pagination indexes (app/pagination.py)", [
+        "CREATE INDEX IF NOT EXISTS ix_templates_created_at_id ON templates (created_at DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS ix_variants_source_id_id ON variants (source_id, id)",
+    ]),
+    (4, "render result cache (app/render.py)", [
+        "ALTER TABLE variants ADD COLUMN IF NOT EXISTS render_hash varchar(64)",
+        "CREATE INDEX IF NOT EXISTS ix_variants_render_hash ON variants (render_hash)",
+    ]),
+    (5, "backfill the asset index (models.Asset) with references that predate it", [
+        # templates.rendition_public_ids (version 8) is newer than the asset index,
+        # every rendition was registered through store_image, none to backfill
+        """INSERT INTO assets (public_id, secure_url, refcount, created_at, updated_at)
+        SELECT public_id, min(url), count(*), now(), now() FROM (
+            SELECT image_public_id AS public_id, image_url AS url FROM templates
+            UNION ALL SELECT thumbnail_public_id, thumbnail_url FROM templates
+            UNION ALL SELECT thumbnail_public_id, thumbnail_url FROM variants
+        ) AS refs
+        GROUP BY public_id
+        ON CONFLICT (public_id) DO NOTHING""",
+    ]),
+    (6, "popularity counters and trending score (?sort=trending|popular)", [
+        "ALTER TABLE templates ADD COLUMN IF NOT EXISTS variant_count integer NOT NULL DEFAULT 0",
+        "ALTER TABLE templates ADD COLUMN IF NOT EXISTS trending_score double precision NOT NULL DEFAULT 0",
+        "ALTER TABLE templates ADD COLUMN IF NOT EXISTS trending_updated_at timestamp DEFAULT now()",
+        # existing variants have no creation time, they count for popular but not trending.
+        # No DEFAULT on the ADD COLUMN, postgres would fill every old row with now()
+        "ALTER TABLE variants ADD COLUMN IF NOT EXISTS created_at timestamp",
+        "ALTER TABLE variants ALTER COLUMN created_at SET DEFAULT now()",
+        """UPDATE templates t SET variant_count = v.n
+        FROM (SELECT source_id, count(*) AS n FROM variants GROUP BY source_id) AS v
+        WHERE t.id = v.source_id""",
+        "CREATE INDEX IF NOT EXISTS ix_templates_trending_id ON templates (trending_score DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS ix_templates_variant_count_id ON templates (variant_count DESC, id DESC)",
+    ]),
+    (7, "normalized tags (?tags= and GET /tags)", [
+        """CREATE TABLE IF NOT EXISTS tags (
+            id serial PRIMARY KEY,
+            name varchar(50) NOT NULL UNIQUE,
+            template_count integer NOT NULL DEFAULT 0
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_tags_template_count_name ON tags (template_count DESC, name)",
+        "CREATE INDEX IF NOT EXISTS ix_tags_name_pattern ON tags (name varchar_pattern_ops)",
+        """CREATE TABLE IF NOT EXISTS template_tags (
+            template_id integer NOT NULL REFERENCES templates (id) ON DELETE CASCADE,
+            tag_id integer NOT NULL REFERENCES tags (id) ON DELETE CASCADE,
+            PRIMARY KEY (template_id, tag_id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_template_tags_tag_id_template_id ON template_tags (tag_id, template_id)",
+        # split the existing free-text tags the way crud.normalize_tags does
+        """CREATE TEMPORARY TABLE tag_backfill ON COMMIT DROP AS
+        SELECT DISTINCT t.id AS template_id,
+            rtrim(left(lower(regexp_replace(btrim(part), '\\s+', ' ', 'g')), 50)) AS name
+        FROM templates t, unnest(string_to_array(t.tag, ',')) AS part
+        WHERE t.tag IS NOT NULL""",
+        "DELETE FROM tag_backfill WHERE name = ''",
+        "INSERT INTO tags (name) SELECT DISTINCT name FROM tag_backfill ON CONFLICT (name) DO NOTHING",
+        """INSERT INTO template_tags (template_id, tag_id)
+        SELECT b.template_id, tags.id FROM tag_backfill b JOIN tags ON tags.name = b.name
+        ON CONFLICT DO NOTHING""",
+        """UPDATE tags SET template_count = coalesce(
+            (SELECT count(*) FROM template_tags tt WHERE tt.tag_id = tags.id), 0)""",
+    ]),
+    (8, "responsive renditions (app/cloud.upload_images)", [
+        # existing templates keep renditions NULL, clients fall back to image_url/thumbnail_url
+        "ALTER TABLE templates ADD COLUMN IF NOT EXISTS renditions jsonb",
+        "ALTER TABLE templates ADD COLUMN IF NOT EXISTS rendition_public_ids jsonb",
+    ]),
+    (9, "perceptual hash for near-duplicates (app/similar.py)", [
+        # existing templates: python -m core.scripts.backfill_phash
+        "ALTER TABLE templates ADD COLUMN IF NOT EXISTS phash bigint",
+    ]),
+    (10, "asset reference indexes for the orphan sweep (crud.sweep_orphan_assets)", [
+        "CREATE INDEX IF NOT EXISTS ix_templates_image_public_id ON templates (image_public_id)",
+        "CREATE INDEX IF NOT EXISTS ix_templates_thumbnail_public_id ON templates (thumbnail_public_id)",
+        "CREATE INDEX IF NOT EXISTS ix_templates_rendition_public_ids ON templates USING gin (rendition_public_ids jsonb_path_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_variants_thumbnail_public_id ON variants (thumbnail_public_id)",
+    ]),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+MIGRATION_LOCK = 7_246_001  # pg_advisory_lock key, any constant unique to this app
+
+async def _applied_version(conn) -> int:
+    await conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version integer PRIMARY KEY, description text, applied_at timestamptz NOT NULL DEFAULT now())"
+    ))
+    return (await conn.execute(text("SELECT coalesce(max(version), 0) FROM schema_version"))).scalar_one()
+
+async def migrate():
+    """Bring the schema to SCHEMA_VERSION, a single SELECT when it already is."""
+    async with database.engine.connect() as conn:
+        # fast path, no lock: the usual boot of an up to date database
+        try:
+            current = (await conn.execute(text("SELECT coalesce(max(version), 0) FROM schema_version"))).scalar_one()
+        except ProgrammingError:  # no schema_version yet
+            current = 0
+            await conn.rollback()
+        await conn.commit()
+        if current >= SCHEMA_VERSION:
+            print(f"[DB INIT] schema at version {current}, nothing to migrate")
+            return
+
+        await conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK})
+        await conn.commit()
+        try:
+            current = await _applied_version(conn)  # another worker may have done it meanwhile
+            await conn.commit()
+            for version, description, steps in MIGRATIONS:
+                if version <= current:
+                    continue
+                print(f"[DB INIT] migrating to version {version}: {description}")
+                async with conn.begin():
+                    for step in steps:
+                        if callable(step):
+                            await conn.run_sync(step)
+                        else:
+                            await conn.execute(text(step))
+                    await conn.execute(
+                        text("INSERT INTO schema_version (version, description) VALUES (:v, :d)"),
+                        {"v": version, "d": description},
+                    )
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK})
+            await conn.commit()
+
+async def prewarm_pool(engine, size: int):
+    """Open `size` connections now so the first requests don't pay for connect + TLS."""
+    size = min(size, engine.pool.size())  # more than pool_size would just be discarded on return
+    conns = await asyncio.gather(*(engine.connect() for _ in range(size)))
+    for conn in conns:
+        await conn.close()  # back to the pool, still open
+    return size
+
+def _backoff(attempt: int) -> float:
+    # exponential with full jitter, so a fleet restarting together doesn't retry in lockstep
+    return random.uniform(0, min(settings.db_startup_max_backoff, settings.db_startup_backoff * 2 ** attempt))
 
-    for attempt in range(1, retries + 1):
+async def init_models():
+    """Migrate and warm the pools, retrying connection errors with backoff until it works."""
+    attempt = 0
+    while True:
         try:
-            print(f"[DB INIT] Attempt {attempt}/{retries} - connecting...")
-            async with database.engine.begin() as conn:
-                await conn.run_sync(models.Base.metadata.create_all)
-            print("[DB INIT] ✅ Database connected and tables created.")
-            break  # Success!
-        except OperationalError as e:
-            print(f"[DB INIT] ❌ Connection failed: {e}")
-            if attempt < retries:
-                print(f"[DB INIT] Retrying in {delay} seconds...")
-                await asyncio.sleep(delay)
-            else:
-                print("[DB INIT] ❌ Database unreachable after several attempts.")
-                raise
-        except Exception as e:
-            print(f"[DB INIT] Unexpected error: {e}")
-            raise
+            st = time.perf_counter()
+            await migrate()
+            warmed = await prewarm_pool(database.engine, settings.db_pool_prewarm)
+            for i, replica in enumerate(database.replicas.engines):
+                try:
+                    await prewarm_pool(replica, settings.db_pool_prewarm)
+                except (OSError, asyncio.TimeoutError, DBAPIError) as e:
+                    database.replicas.mark_down(i, e)
+            print(f"[DB INIT] ✅ ready in {time.perf_counter() - st:.2f}s, {warmed} connections warm")
+            return
+        except (OSError, asyncio.TimeoutError, OperationalError, InterfaceError) as e:
+            delay = _backoff(attempt)
+            attempt += 1
+            print(f"[DB INIT] ❌ attempt {attempt} failed: {e}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
 
 async def close_db():
     """Close database connections (on shutdown)."""
     print("[DB CLOSE] Disposing SQLAlchemy engine...")
-    await database.engine.dispose()
+    await database.dispose_engines()
     print("[DB CLOSE] ✅ Connections closed.")
 
+async def start_up(app: FastAPI):
+    """Runs behind the lifespan so /health answers right away, /ready flips once this is done."""
+    try:
+        await init_models()
+    except Exception as e:
+        app.state.startup_error = str(e)
+        print(f"[DB INIT] Unexpected error: {e}")
+        raise
+    app.state.background.append(asyncio.create_task(tasks.run_cache_invalidations()))
+    app.state.background.append(asyncio.create_task(tasks.run_asset_deletions()))
+    st = time.perf_counter()
+    loaded = await tasks.load_phash_index()
+    print(f"[SIMILAR] {loaded} image hashes indexed in {time.perf_counter() - st:.2f}s")
+    app.state.background.append(asyncio.create_task(tasks.run_phash_refresh()))
+    await image_executor.prewarm()
+    app.state.ready = True
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Handle startup and shutdown events with resilience."""
     print("🚀 App starting up — initializing database...")
-    await init_models()
+    app.state.ready = False
+    app.state.startup_error = None
+    app.state.background = []
+    app.state.background.append(asyncio.create_task(start_up(app)))
 
     yield  # Application runs here
 
     print("🛑 App shutting down — closing database connections...")
+    app.state.ready = False
+    for task in app.state.background:
+        task.cancel()
+    await asyncio.gather(*app.state.background, return_exceptions=True)
     await close_db()
+    await close_storage()
+    hash_executor.shutdown()
+    render_executor.shutdown()
+    image_executor.shutdown()
+    io_executor.shutdown()
@@ -4,11 +4,105 @@ class Settings(BaseSettings):
     database_url: str = "sqlite:///./test.db"
     secret_key: str
     debug: bool = False
-    cloud_name: str
-    cloud_api_key: str
-    cloud_api_secret: str
+    cloud_name: str = ""
+    cloud_api_key: str = ""
+    cloud_api_secret: str = ""
     access_token_expire_minutes: int = 60
 
+    # connection pool per engine, and startup (core/scripts/create_db_records.py)
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_prewarm: int = 5  # connections opened before the worker reports ready
+    db_startup_backoff: float = 0.5  # first retry delay, doubles per attempt (jittered)
+    db_startup_max_backoff: float = 30.0
+
+    # read replicas (app/database.get_read_db), comma separated urls, empty = primary only
+    database_replica_urls: str = ""
+    database_ssl: bool = True  # off for local instances without core/ssl/ca.pem certs
+    replica_sticky_seconds: float = 5.0  # a client reads from the primary this long after its own write
+    replica_connect_timeout: float = 2.0
+    replica_retry_after: float = 30.0  # how long a replica that failed to connect is skipped
+
+    # password hashing pool (argon2 is CPU + memory heavy)
+    hash_workers: int = 2
+    hash_queue_size: int = 16
+
+    # responsive renditions of template images (app/cloud.py), longest side in px.
+    # AVIF needs Pillow built with libavif and encodes several times slower than WebP
+    rendition_sizes: str = "256,512,1024,2048"
+    rendition_avif: bool = False
+    rendition_avif_quality: int = 50
+
+    # near-duplicate detection (app/similar.py), hamming distance between 64-bit dHashes.
+    # POST /templates warns at or below similar_duplicate_distance
+    similar_duplicate_distance: int = 6
+    similar_max_distance: int = 11  # ceiling for GET /templates/{id}/similar?max_distance=
+    similar_refresh_interval: float = 30.0
+
+    # upload decode/resize/encode worker processes (core/executors.py), spawn is the
+    # safe start method with threads around, forkserver starts faster on linux
+    image_workers: int = 2
+    image_queue_size: int = 16
+    image_start_method: str = "spawn"
+
+    # blocking i/o threads: local storage backend, copying spooled uploads
+    io_workers: int = 8
+    io_queue_size: int = 64
+
+    # verified token -> user cache, ttl is capped by the token's own exp
+    principal_cache_size: int = 4096
+    principal_cache_ttl: int = 300
+
+    # template read responses (app/http_cache.py), invalidated on writes
+    response_cache_size: int = 512
+    response_cache_ttl: int = 30
+    # cross-worker invalidation listener (app/tasks.run_cache_invalidations)
+    cache_listener_ping_interval: float = 5.0  # how quickly a dead listener connection is noticed
+    cache_listener_retry: float = 2.0
+
+    # image ingestion limits (app/cloud.py)
+    max_upload_bytes: int = 20 * 1024 * 1024
+    max_image_pixels: int = 50_000_000
+    # whole request body, enforced while it arrives (app/cloud.UploadLimitMiddleware), room for a
+    # template with its thumbnail or a batch of variant thumbnails
+    max_request_bytes: int = 64 * 1024 * 1024
+
+    # where images are stored (app/storage.py): cloudinary | local | memory
+    storage_backend: str = "cloudinary"
+    storage_max_connections: int = 20
+    storage_local_root: str = "./media"
+    storage_local_url: str = "/media"
+
+    # background asset deletion (app/tasks.py)
+    asset_deletion_interval: float = 5.0
+    asset_deletion_batch_size: int = 100
+    asset_deletion_max_backoff: int = 3600
+    orphan_sweep_interval: int = 3600
+    orphan_sweep_grace: int = 3600
+
+    # server-side variant rendering (app/render.py), fonts are looked up by
+    # family name in font_dir ("Impact" -> impact.ttf, bold -> impact-bold.ttf)
+    render_workers: int = 2
+    render_queue_size: int = 16
+    render_base_cache_size: int = 64
+    render_result_cache_size: int = 10000
+    font_dir: str = "./core/fonts"
+
+    # ?sort=trending: a variant's weight halves every trending_half_life_hours
+    # (app/crud.py), what a deleted variant leaves under the floor counts as 0
+    trending_half_life_hours: float = 24.0
+    trending_score_floor: float = 0.01
+
+    # POST /variants:batch and GET /templates?ids=
+    variant_batch_max_size: int = 50
+    variant_batch_concurrency: int = 8  # uploads/renders in flight per batch request
+    template_ids_max: int = 100
+
+    # normalized tags (comma separated Template.tag), GET /templates?tags= and GET /tags
+    tags_per_template_max: int = 10
+    tags_filter_max: int = 10
+    tags_list_max: int = 200
+
     class Config:
         env_file = ".env"  # auto-loads from .env
 
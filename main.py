@@ -3,12 +3,22 @@ from fastapi import FastAPI
 from app import routes
 from core.settings import settings
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.staticfiles import StaticFiles
 from core.scripts.create_db_records import lifespan
+from app.pagination import NEXT_CURSOR_HEADER
+from core.metrics import MetricsMiddleware
+from app.database import WriteMarkerMiddleware
+from app.cloud import UploadLimitMiddleware
 
 
 app = FastAPI(debug=settings.debug, title="Meme Manager", lifespan=lifespan,)
 app.include_router(routes.router)
 
+# local storage backend serves its own files
+if settings.storage_backend == "local":
+    from app.storage import get_storage
+    app.mount(settings.storage_local_url, StaticFiles(directory=get_storage().root), name="media")
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -16,5 +26,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
 
+# refuse oversized bodies before they are spooled (app/cloud.py)
+app.add_middleware(UploadLimitMiddleware)
+
+# read-your-writes cookie for replica routing (app/database.py)
+app.add_middleware(WriteMarkerMiddleware)
+
+# outermost, so latency includes CORS and every other middleware
+app.add_middleware(MetricsMiddleware)
+